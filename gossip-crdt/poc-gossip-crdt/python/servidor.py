@@ -1,42 +1,1088 @@
 # Servidor P2P (Python) - Gossip + CRDT LWW-Map - Logs detalhados de convergência
 import os
+import sys
+import json
+import codecs
+import zlib
+import struct
 import asyncio
 import random
 import time
+import uuid
+import socket
+import hashlib
+import mmap
+import atexit
 import logging
-from typing import Dict, Tuple, List, Iterable, DefaultDict, Union
+import logging.handlers
+import queue
+import weakref
+import bisect
+import heapq
+from typing import Dict, Tuple, List, Iterable, Iterator, AsyncIterator, DefaultDict, Union, Optional
 from collections import defaultdict
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from array import array
+from itertools import repeat
 
 import aiohttp
 from aiohttp import web
 
+try:
+    import numpy as np
+except ImportError:  # só o backend colunar precisa
+    np = None
+
+# ------------------ Métricas (formato texto do Prometheus) ------------------
+def _rotulos(chave: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    partes = [f'{k}="{v}"' for k, v in chave]
+    if extra: partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+class Contador:
+    def __init__(self, nome: str, ajuda: str):
+        self.nome, self.ajuda = nome, ajuda
+        self._series: Dict[Tuple[Tuple[str, str], ...], float] = defaultdict(float)
+
+    def inc(self, valor: float = 1.0, **rotulos: str):
+        self._series[tuple(sorted(rotulos.items()))] += valor
+
+    def total(self) -> float:
+        return sum(self._series.values())
+
+    def expor(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        linhas += [f"{self.nome}{_rotulos(k)} {v}" for k, v in self._series.items()]
+        return linhas
+
+class Medidor(Contador):
+    def definir(self, valor: float, **rotulos: str):
+        self._series[tuple(sorted(rotulos.items()))] = valor
+
+    def expor(self) -> List[str]:
+        linhas = super().expor()
+        linhas[1] = f"# TYPE {self.nome} gauge"
+        return linhas
+
+class Histograma:
+    def __init__(self, nome: str, ajuda: str, limites: Tuple[float, ...]):
+        self.nome, self.ajuda, self.limites = nome, ajuda, limites
+        # por série: [contagem por balde..., +Inf], soma
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observar(self, valor: float, **rotulos: str):
+        self.observar_varios((valor,), **rotulos)
+
+    def observar_varios(self, valores: Iterable[float], **rotulos: str):
+        chave = tuple(sorted(rotulos.items()))
+        serie = self._series.get(chave)
+        if serie is None:
+            serie = self._series[chave] = [[0] * (len(self.limites) + 1), 0.0]
+        contagens = serie[0]
+        for v in valores:
+            contagens[bisect.bisect_left(self.limites, v)] += 1
+            serie[1] += v
+
+    def expor(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for chave, (contagens, soma) in self._series.items():
+            acum = 0
+            for lim, c in zip(self.limites + (float("inf"),), contagens):
+                acum += c
+                le = "+Inf" if lim == float("inf") else repr(lim)
+                rot = _rotulos(chave, 'le="%s"' % le)
+                linhas.append(f"{self.nome}_bucket{rot} {acum}")
+            linhas.append(f"{self.nome}_sum{_rotulos(chave)} {soma}")
+            linhas.append(f"{self.nome}_count{_rotulos(chave)} {acum}")
+        return linhas
+
+_SEGUNDOS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+_LOTES = (1, 10, 100, 1000, 10000, 100000)
+_LAG = (0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+class MetricasNo:
+    """Instrumentação do nó exposta em GET /metrics."""
+    def __init__(self):
+        self.merge_segundos = Histograma("lww_merge_segundos", "Duração de merge_many/merge_colunas", _SEGUNDOS)
+        self.merge_lote = Histograma("lww_merge_lote_entradas", "Entradas por lote de merge", _LOTES)
+        self.lock_espera = Histograma("lww_lock_espera_segundos", "Espera para obter os locks de shard", _SEGUNDOS)
+        self.lag = Histograma("lww_replicacao_lag_segundos",
+                              "Agora menos o ts da entrada remota aceita", _LAG)
+        self.enviado_bytes = Contador("gossip_enviado_bytes_total", "Bytes de gossip enviados por peer")
+        self.enviado_entradas = Contador("gossip_enviado_entradas_total", "Entradas de gossip enviadas por peer")
+        self.recebido_bytes = Contador("gossip_recebido_bytes_total", "Bytes de gossip recebidos por peer")
+        self.recebido_entradas = Contador("gossip_recebido_entradas_total", "Entradas de gossip recebidas por peer")
+        self.falhas = Contador("gossip_falhas_total", "Falhas de envio de gossip por peer")
+        self.udp = Contador("gossip_udp_envios_total", "Envios de gossip por datagrama, por resultado")
+        self.despejos = Contador("lww_despejos_total", "Chaves removidas do mapa, por motivo (ttl|limite|repasse)")
+        self.ingest_recebidas = Contador("ingest_escritas_recebidas_total", "Escritas recebidas em POST /ingest")
+        self.ingest_aplicadas = Contador("ingest_escritas_aplicadas_total",
+                                         "Escritas de /ingest aplicadas depois de coalescer por chave")
+        self.rejeitadas = Contador("lww_rejeitadas_total", "Entradas recusadas por estarem expiradas ou já despejadas")
+        self.rodada_segundos = Histograma("gossip_rodada_segundos", "Duração de uma rodada de disseminar", _SEGUNDOS)
+        self.intervalo = Medidor("gossip_intervalo_segundos", "Intervalo atual entre rodadas de gossip")
+        self.chaves = Medidor("lww_chaves", "Chaves no LWW-Map")
+        self.versao = Medidor("lww_versao", "Versão (alterações aplicadas) do LWW-Map")
+
+    def expor(self) -> str:
+        linhas: List[str] = []
+        for m in vars(self).values():
+            linhas += m.expor()
+        return "\n".join(linhas) + "\n"
+
 # ------------------ CRDT: LWW-Map ------------------
+# Árvore de hashes (Merkle) para anti-entropia: as chaves são distribuídas em
+# MERKLE_FOLHAS baldes por crc32; cada folha guarda o XOR dos hashes das
+# entradas do balde e cada nó interno o XOR dos filhos. Como XOR é reversível,
+# uma alteração só atualiza a sua folha; os nós internos são recalculados sob
+# demanda (MERKLE_FOLHAS - 1 XORs) quando alguém pede hashes.
+# A árvore é indexada como heap: raiz = 1, filhos de n = 2n e 2n+1.
+MERKLE_FOLHAS = 256
+
+def balde_da_chave(key: str) -> int:
+    return zlib.crc32(key.encode()) % MERKLE_FOLHAS
+
+def dividir_chave(key: str) -> Tuple[str, str]:
+    """"disp3:temperatura" -> ("disp3", "temperatura"); sem ":" a métrica é "valor"."""
+    disp, sep, met = key.partition(":")
+    return disp, (met if sep else "valor")
+
+_ENTRADA = struct.Struct("<qqd")
+
+def _hash_entrada(chave: bytes, ts: int, nid: int, val: float) -> int:
+    """Hash de 64 bits da entrada para a folha de Merkle: blake2b sobre
+    (ts, node_id, valor) empacotados e a chave já codificada em UTF-8."""
+    dig = hashlib.blake2b(_ENTRADA.pack(ts, nid, val) + chave, digest_size=8).digest()
+    return int.from_bytes(dig, "little")
+
+class PoliticaTTL:
+    """TTL por prefixo de chave, contado a partir do ts da entrada. Formato de
+    LWW_TTL: "disp9:temperatura=60,disp=300,*=3600" (segundos); vale o prefixo
+    mais longo, então uma chave inteira funciona como TTL por chave."""
+    def __init__(self, spec: str):
+        regras = []
+        for parte in spec.split(","):
+            if not parte.strip(): continue
+            prefixo, _, segundos = parte.partition("=")
+            prefixo = prefixo.strip()
+            regras.append(("" if prefixo == "*" else prefixo, int(float(segundos) * 1000)))
+        self._regras = sorted(regras, key=lambda r: -len(r[0]))
+
+    def ttl_ms(self, key: str) -> Optional[int]:
+        for prefixo, ms in self._regras:
+            if key.startswith(prefixo): return ms
+        return None
+
+# Snapshots sem cópia: a vista lê o estado vivo e, para as chaves alteradas
+# depois de criada, o valor anterior que os escritores guardam em `_antes`
+# (só na primeira alteração de cada chave). Sem vistas vivas, escrever não
+# custa nada a mais; com vistas, custa uma entrada por chave alterada.
+_AUSENTE = object()  # em _antes: a chave não existia quando a vista foi criada
+_NADA = object()
+
+class VistaEstado(Mapping):
+    """Snapshot imutável do LWWMap: chave -> (ts, node_id, valor)."""
+    def __init__(self, estado, n: int):
+        self._estado = estado
+        self._n = n
+        self._antes: Dict[str, object] = {}
+
+    def __getitem__(self, key: str) -> Tuple[int, int, float]:
+        v = self._antes.get(key, _NADA)
+        if v is _NADA: return self._estado[key]
+        if v is _AUSENTE: raise KeyError(key)
+        return v
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self):
+        antes, estado = self._antes, self._estado
+        # capturados juntos, sem await: chaves vivas agora e as que existiam na
+        # criação da vista mas já saíram do estado
+        vivas = list(estado.keys())
+        removidas = [k for k, v in antes.items() if v is not _AUSENTE and k not in estado]
+        for k in vivas:
+            if antes.get(k) is not _AUSENTE: yield k
+        yield from removidas
+
+_MARCA_DESPEJO = 0.9  # ao passar do limite, despeja até 90% dele
+
 class LWWMap:
-    def __init__(self):
+    # Concorrência: as escritas travam só os shards (por prefixo de dispositivo)
+    # que tocam, em ordem crescente para não haver deadlock. A aplicação de um
+    # lote não tem pontos de await, então leitores (snapshot, delta, hashes)
+    # nunca veem um lote pela metade e dispensam lock.
+    # Expiração: com `ttl`, cada alteração entra num heap (expira_ms, chave)
+    # consultado por expirar(); com `max_chaves`, num heap (ts, chave) de onde
+    # saem as mais antigas quando o mapa passa do limite. Os heaps são
+    # preguiçosos: entradas superadas são descartadas ao chegar ao topo.
+    # Para peers não ressuscitarem o que saiu, entradas expiradas são recusadas
+    # e, depois de um despejo por limite, chaves ausentes com ts <= _piso_ts também.
+    def __init__(self, shards: int = 16, metricas: Optional[MetricasNo] = None,
+                 ttl: Optional[PoliticaTTL] = None, max_chaves: int = 0,
+                 historico: Optional["HistoricoLWW"] = None):
         self._state: Dict[str, Tuple[int, int, float]] = {}
-        self._lock = asyncio.Lock()
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+        self.metricas = metricas
+        # versionamento por chave para gossip incremental (delta-state):
+        # cada alteração aplicada recebe uma versão crescente e a chave vai
+        # para o fim de _alteracoes, que fica ordenado por versão.
+        self._versao = 0
+        self._alteracoes: Dict[str, int] = {}
+        self._arvore: List[int] = [0] * (2 * MERKLE_FOLHAS)
+        self._arvore_suja = False
+        self._baldes: List[set] = [set() for _ in range(MERKLE_FOLHAS)]
+        # hash de cada entrada guardado junto dela: ao superar ou remover a
+        # entrada, a folha sai por XOR sem recalcular o hash antigo
+        self._folhas: Dict[str, int] = {}
+        # índice secundário por dispositivo para as leituras (GET /chave,
+        # /dispositivo, /dispositivos): dispositivo -> {chave: métrica}, a
+        # lista ordenada de dispositivos (faixas por prefixo via bisect) e a
+        # versão da última alteração de cada dispositivo (ETag)
+        self._por_disp: Dict[str, Dict[str, str]] = {}
+        self._disps: List[str] = []
+        self._versao_disp: Dict[str, int] = {}
+        self.ttl = ttl
+        self.max_chaves = max_chaves
+        self._expiracoes: List[Tuple[int, str]] = []
+        self._por_ts: List[Tuple[int, str]] = []
+        self._piso_ts: Optional[int] = None
+        self._vistas: Dict[int, weakref.ref] = {}  # snapshots vivos, por id
+        # histórico local dos valores aceitos; não entra no gossip
+        self.historico = historico
+
+    @property
+    def versao(self) -> int:
+        return self._versao
+
+    def _guardar_antigo(self, key: str, antigo: Optional[Tuple[int, int, float]]):
+        for ref in list(self._vistas.values()):
+            vista = ref()
+            if vista is not None: vista._antes.setdefault(key, _AUSENTE if antigo is None else antigo)
+
+    def _registrar(self, key: str, antigo: Optional[Tuple[int, int, float]], novo: Tuple[int, int, float]):
+        if self._vistas: self._guardar_antigo(key, antigo)
+        self._versao = versao = self._versao + 1
+        alteracoes = self._alteracoes
+        alteracoes.pop(key, None)  # dict mantém a ordem de inserção
+        alteracoes[key] = versao
+        kb = key.encode()
+        b = zlib.crc32(kb) % MERKLE_FOLHAS  # balde_da_chave sem codificar de novo
+        folha = _hash_entrada(kb, *novo)
+        self._arvore[MERKLE_FOLHAS + b] ^= folha ^ self._folhas.get(key, 0)
+        self._folhas[key] = folha
+        self._arvore_suja = True
+        if antigo:
+            self._versao_disp[key.partition(":")[0]] = versao
+        else:
+            self._baldes[b].add(key)
+            disp, met = dividir_chave(key)
+            chaves = self._por_disp.get(disp)
+            if chaves is None:
+                chaves = self._por_disp[disp] = {}
+                bisect.insort(self._disps, disp)
+            chaves[key] = met
+            self._versao_disp[disp] = versao
+        self._acompanhar(key, novo)
+
+    def _acompanhar(self, key: str, novo: Tuple[int, int, float]):
+        """Heaps de TTL e de limite e histórico da entrada recém-aceita."""
+        if self.ttl is not None:
+            ms = self.ttl.ttl_ms(key)
+            if ms is not None: heapq.heappush(self._expiracoes, (novo[0] + ms, key))
+        if self.max_chaves: heapq.heappush(self._por_ts, (novo[0], key))
+        if self.historico is not None: self.historico.registrar(key, novo[0], novo[2])
+
+    def _remover(self, key: str, motivo: str):
+        """Tira a chave do estado, das versões, da árvore de Merkle e do índice."""
+        antigo = self._state.pop(key)
+        if self._vistas: self._guardar_antigo(key, antigo)
+        self._versao += 1
+        del self._alteracoes[key]
+        b = balde_da_chave(key)
+        self._baldes[b].discard(key)
+        self._arvore[MERKLE_FOLHAS + b] ^= self._folhas.pop(key)
+        self._arvore_suja = True
+        disp, _ = dividir_chave(key)
+        chaves = self._por_disp[disp]
+        del chaves[key]
+        if chaves:
+            self._versao_disp[disp] = self._versao
+        else:
+            del self._por_disp[disp], self._versao_disp[disp]
+            del self._disps[bisect.bisect_left(self._disps, disp)]
+        if self.historico is not None: self.historico.remover(key)
+        if self.metricas: self.metricas.despejos.inc(motivo=motivo)
+
+    def _viva(self, key: str, ts: int, agora_ms: int) -> bool:
+        if self.ttl is not None:
+            ms = self.ttl.ttl_ms(key)
+            if ms is not None and ts + ms <= agora_ms: return False
+        return self._piso_ts is None or ts > self._piso_ts or key in self._state
+
+    def _filtrar_vivas(self, items: List[Tuple[str, int, int, float]]) -> List[Tuple[str, int, int, float]]:
+        if self.ttl is None and self._piso_ts is None: return items
+        agora_ms = int(time.time() * 1000)
+        vivas = [it for it in items if self._viva(it[0], it[1], agora_ms)]
+        if self.metricas and len(vivas) < len(items): self.metricas.rejeitadas.inc(len(items) - len(vivas))
+        return vivas
+
+    @staticmethod
+    def _compactar(heap: List[Tuple[int, str]], validas) -> List[Tuple[int, str]]:
+        # o heap preguiçoso acumula entradas superadas; refaz quando passa do dobro
+        heap = [e for e in heap if validas(e)]
+        heapq.heapify(heap)
+        return heap
+
+    def _limitar(self):
+        if not self.max_chaves: return
+        if len(self._state) > self.max_chaves:
+            alvo = int(self.max_chaves * _MARCA_DESPEJO)
+            while len(self._state) > alvo and self._por_ts:
+                ts, key = heapq.heappop(self._por_ts)
+                cur = self._state.get(key)
+                if cur is not None and cur[0] == ts:
+                    self._remover(key, "limite")
+                    self._piso_ts = ts if self._piso_ts is None else max(self._piso_ts, ts)
+        # sobrescritas deixam entradas superadas no heap mesmo abaixo do limite
+        if len(self._por_ts) > 2 * len(self._state) + 1024:
+            self._por_ts = self._compactar(self._por_ts, lambda e: self._state.get(e[1], (None,))[0] == e[0])
+
+    async def expirar(self) -> int:
+        """Remove as entradas com TTL vencido; devolve quantas saíram."""
+        if self.ttl is None: return 0
+        agora_ms = int(time.time() * 1000)
+        n = 0
+        heap = self._expiracoes
+        while heap and heap[0][0] <= agora_ms:
+            expira, key = heapq.heappop(heap)
+            cur = self._state.get(key)
+            # só vale se a entrada atual é a que gerou este prazo
+            if cur is not None and cur[0] + (self.ttl.ttl_ms(key) or 0) == expira:
+                self._remover(key, "ttl")
+                n += 1
+        if len(heap) > 2 * len(self._state) + 1024:
+            def valida(e):
+                cur = self._state.get(e[1])
+                return cur is not None and cur[0] + (self.ttl.ttl_ms(e[1]) or 0) == e[0]
+            self._expiracoes = self._compactar(heap, valida)
+        return n
 
     @staticmethod
     def _maior(a, b) -> bool:
         (tsa, na), (tsb, nb) = a, b
         return (tsa > tsb) or (tsa == tsb and na > nb)
 
+    def _shard(self, key: str) -> int:
+        return hash(key.partition(":")[0]) % len(self._locks)
+
+    @asynccontextmanager
+    async def _travar(self, keys: Iterable[str]):
+        n = len(self._locks)
+        disps = {k.partition(":")[0] for k in keys}
+        locks = [self._locks[i] for i in sorted({hash(d) % n for d in disps})]
+        t0 = time.perf_counter()
+        for lock in locks: await lock.acquire()
+        if self.metricas: self.metricas.lock_espera.observar(time.perf_counter() - t0)
+        try: yield
+        finally:
+            for lock in reversed(locks): lock.release()
+
     async def put(self, key: str, ts: int, node_id: int, value: float):
-        async with self._lock:
+        async with self._locks[self._shard(key)]:
+            if not self._filtrar_vivas([(key, ts, node_id, value)]): return
             cur = self._state.get(key)
             if not cur or self._maior((ts, node_id), (cur[0], cur[1])):
-                self._state[key] = (ts, node_id, value)
+                self._state[key] = novo = (ts, node_id, value)
+                self._registrar(key, cur, novo)
+                self._limitar()
+
+    def _aplicar_lote(self, items: Iterable[Tuple[str, int, int, float]]):
+        for k, ts, nid, val in items:
+            cur = self._state.get(k)
+            if not cur or (ts > cur[0] or (ts == cur[0] and nid > cur[1])):
+                self._state[k] = novo = (ts, nid, float(val))
+                self._registrar(k, cur, novo)
+
+    def _aplicar_colunas(self, keys, ts, nid, val):
+        self._aplicar_lote(zip(keys, ts, nid, val))
+
+    def _medir_merge(self, n: int, t0: float, versao_antes: int, remoto: bool):
+        m = self.metricas
+        m.merge_segundos.observar(time.perf_counter() - t0)
+        m.merge_lote.observar(n)
+        if remoto and self._versao > versao_antes:
+            # lag de replicação das entradas remotas aceitas neste lote
+            agora_ms = time.time() * 1000
+            m.lag.observar_varios([(agora_ms - ts) / 1000 for ts in self._ts_desde(versao_antes)])
+
+    def _ts_desde(self, versao: int) -> List[int]:
+        """ts das entradas alteradas depois de `versao`."""
+        saida = []
+        for k in reversed(self._alteracoes):
+            if self._alteracoes[k] <= versao: break
+            saida.append(self._state[k][0])
+        return saida
+
+    async def merge_many(self, items: Iterable[Tuple[str, int, int, float]], remoto: bool = True) -> Tuple[int, int]:
+        """Aplica o lote; devolve a faixa (início exclusivo, fim) das versões que ele gerou."""
+        items = list(items)
+        async with self._travar(k for k, _, _, _ in items):
+            t0, versao_antes = time.perf_counter(), self._versao
+            self._aplicar_lote(self._filtrar_vivas(items))
+            self._limitar()
+            if self.metricas: self._medir_merge(len(items), t0, versao_antes, remoto)
+            return versao_antes, self._versao
+
+    async def put_many(self, items: Iterable[Tuple[str, int, int, float]]):
+        """Escritas locais em lote: um único await para todas as chaves."""
+        await self.merge_many(items, remoto=False)
+
+    async def merge_colunas(self, keys: List[str], ts, nid, val, remoto: bool = True) -> Tuple[int, int]:
+        """Merge de um lote já em colunas (ex.: quadro do formato binário); como merge_many."""
+        async with self._travar(keys):
+            t0, versao_antes = time.perf_counter(), self._versao
+            if self.ttl is not None or self._piso_ts is not None:
+                vivas = self._filtrar_vivas(list(zip(keys, ts, nid, val)))
+                if vivas: self._aplicar_colunas(*map(list, zip(*vivas)))
+            else:
+                self._aplicar_colunas(keys, ts, nid, val)
+            self._limitar()
+            if self.metricas: self._medir_merge(len(keys), t0, versao_antes, remoto)
+            return versao_antes, self._versao
+
+    async def descartar(self, keys: Iterable[str], motivo: str) -> int:
+        """Remove `keys` do mapa (as ausentes são ignoradas); devolve quantas saíram."""
+        n = 0
+        for key in keys:
+            if key in self._state:
+                self._remover(key, motivo)
+                n += 1
+        return n
+
+    async def snapshot(self) -> Mapping:
+        """Vista imutável e consistente do estado em O(1), sem copiar entradas."""
+        vista = VistaEstado(self._state, len(self._state))
+        ident, vistas = id(vista), self._vistas
+        vistas[ident] = weakref.ref(vista, lambda _: vistas.pop(ident, None))
+        return vista
+
+    async def delta_desde(self, versao: int) -> Tuple[List[Tuple[str, int, int, float]], int]:
+        """Entradas alteradas depois de `versao` e a versão atual.
+        Percorre _alteracoes de trás para frente, então o custo é proporcional
+        ao delta e não ao tamanho do mapa. `versao=0` devolve o estado completo."""
+        items = []
+        for k in reversed(self._alteracoes):
+            if self._alteracoes[k] <= versao: break
+            ts, nid, val = self._state[k]
+            items.append((k, ts, nid, val))
+        return items, self._versao
+
+    async def hashes(self, nos: Iterable[int]) -> List[int]:
+        """Hashes dos nós da árvore de Merkle (índices de heap)."""
+        arv = self._arvore
+        if self._arvore_suja:
+            for n in range(MERKLE_FOLHAS - 1, 0, -1):
+                arv[n] = arv[2 * n] ^ arv[2 * n + 1]
+            self._arvore_suja = False
+        return [arv[n] for n in nos]
+
+    async def entradas_baldes(self, baldes: Iterable[int]) -> List[Tuple[str, int, int, float]]:
+        return [(k, *self._state[k]) for b in baldes for k in self._baldes[b]]
+
+    # --- leituras pelo índice; as versões servem de ETag sem serializar nada ---
+    def versao_chave(self, key: str) -> int:
+        return self._alteracoes.get(key, 0)
+
+    def versao_dispositivos(self, disps: Iterable[str]) -> int:
+        return max((self._versao_disp.get(d, 0) for d in disps), default=0)
+
+    def faixa_dispositivos(self, prefixo: str = "") -> List[str]:
+        """Dispositivos que começam com `prefixo`, em ordem."""
+        i = bisect.bisect_left(self._disps, prefixo)
+        j = bisect.bisect_left(self._disps, prefixo + "\U0010ffff") if prefixo else len(self._disps)
+        return self._disps[i:j]
+
+    async def obter(self, key: str) -> Optional[Tuple[int, int, float]]:
+        return self._state.get(key)
+
+    async def agrupar(self, disps: Iterable[str]) -> Dict[str, Dict[str, Tuple[int, int, float]]]:
+        """{dispositivo: {métrica: (ts, node_id, valor)}} dos dispositivos pedidos."""
+        return {d: {met: self._state[k] for k, met in self._por_disp[d].items()}
+                for d in disps if d in self._por_disp}
+
+# ------------------ Backend colunar ------------------
+_TS_VAZIO = -(2 ** 63)  # sentinela de posição sem entrada: perde para qualquer ts
+
+class ColunasLWW:
+    """Armazenamento colunar do LWW-Map (requer NumPy): cada chave é internada
+    num id que indexa colunas contíguas com a entrada (ts, node_id, valor) e
+    com o que o LWWMap guarda em dicts por chave: versão da última alteração,
+    hash da entrada, balde de Merkle e dispositivo. Por chave sobram só a
+    string e a entrada em `_ids`. Expõe a interface de mapeamento do dict
+    usado pelo LWWMap."""
+    _COLUNAS = (("_ts", "i8"), ("_nid", "i8"), ("_val", "f8"), ("_ver", "i8"),
+                ("_folha", "u8"), ("_balde", "i4"), ("_disp", "i4"))
 
-    async def merge_many(self, items: Iterable[Tuple[str, int, int, float]]):
-        async with self._lock:
-            for k, ts, nid, val in items:
-                cur = self._state.get(k)
-                if not cur or (ts > cur[0] or (ts == cur[0] and nid > cur[1])):
-                    self._state[k] = (ts, nid, float(val))
+    def __init__(self, capacidade: int = 1024):
+        self._ids: Dict[str, int] = {}
+        self._chaves: List[Optional[str]] = []
+        self._livres: List[int] = []  # posições de chaves removidas, reaproveitadas
+        for nome, tipo in self._COLUNAS: setattr(self, nome, np.zeros(capacidade, tipo))
+        self._ts.fill(_TS_VAZIO)
+        # dispositivos internados à parte (são poucos): nome <-> id e quantas
+        # chaves cada um tem; o id é liberado quando a última chave sai
+        self._disp_ids: Dict[str, int] = {}
+        self._nomes_disp: List[Optional[str]] = []
+        self._n_disp: List[int] = []
+        self._livres_disp: List[int] = []
 
-    async def snapshot(self) -> Dict[str, Tuple[int, int, float]]:
-        async with self._lock:
-            return dict(self._state)
+    def _crescer(self):
+        for nome, tipo in self._COLUNAS:
+            col = getattr(self, nome)
+            extra = np.full(len(col), _TS_VAZIO, tipo) if nome == "_ts" else np.zeros(len(col), tipo)
+            setattr(self, nome, np.concatenate((col, extra)))
+
+    def _internar_disp(self, disp: str) -> int:
+        d = self._disp_ids.get(disp)
+        if d is None:
+            if self._livres_disp:
+                d = self._livres_disp.pop()
+                self._nomes_disp[d] = disp
+            else:
+                d = len(self._nomes_disp)
+                self._nomes_disp.append(disp)
+                self._n_disp.append(0)
+            self._disp_ids[disp] = d
+        return d
+
+    def _internar(self, key: str) -> int:
+        i = self._ids.get(key)
+        if i is not None: return i
+        if self._livres:
+            i = self._livres.pop()
+            self._chaves[i] = key
+        else:
+            i = len(self._chaves)
+            self._chaves.append(key)
+            if i == len(self._ts): self._crescer()
+        self._ids[key] = i
+        d = self._internar_disp(key.partition(":")[0])
+        self._n_disp[d] += 1
+        self._disp[i] = d
+        self._balde[i] = balde_da_chave(key)
+        return i
+
+    def _internar_lote(self, keys: List[str]):
+        """ids de `keys`; as chaves novas são internadas de uma vez."""
+        novas = [k for k in dict.fromkeys(keys) if k not in self._ids]
+        if novas:
+            r = min(len(novas), len(self._livres))
+            pos = self._livres[len(self._livres) - r:]
+            del self._livres[len(self._livres) - r:]
+            for i, k in zip(pos, novas): self._chaves[i] = k
+            pos.extend(range(len(self._chaves), len(self._chaves) + len(novas) - r))
+            self._chaves.extend(novas[r:])
+            while len(self._chaves) > len(self._ts): self._crescer()
+            self._ids.update(zip(novas, pos))
+            pos = np.array(pos, np.int64)
+            self._balde[pos] = np.fromiter(map(balde_da_chave, novas), np.int32, len(novas))
+            disps = np.fromiter((self._internar_disp(k.partition(":")[0]) for k in novas), np.int32, len(novas))
+            self._disp[pos] = disps
+            for d, n in zip(*(x.tolist() for x in np.unique(disps, return_counts=True))):
+                self._n_disp[d] += n
+        return np.fromiter(map(self._ids.__getitem__, keys), np.int64, len(keys))
+
+    def get(self, key: str, default=None):
+        i = self._ids.get(key)
+        if i is None: return default
+        return (int(self._ts[i]), int(self._nid[i]), float(self._val[i]))
+
+    def __getitem__(self, key: str) -> Tuple[int, int, float]:
+        i = self._ids[key]
+        return (int(self._ts[i]), int(self._nid[i]), float(self._val[i]))
+
+    def __setitem__(self, key: str, entrada: Tuple[int, int, float]):
+        i = self._internar(key)
+        self._ts[i], self._nid[i], self._val[i] = entrada
+
+    def pop(self, key: str) -> Tuple[int, int, float]:
+        entrada = self[key]
+        i = self._ids.pop(key)
+        self._ts[i], self._nid[i], self._val[i], self._ver[i], self._folha[i] = _TS_VAZIO, 0, 0.0, 0, 0
+        self._chaves[i] = None
+        self._livres.append(i)
+        d = int(self._disp[i])
+        self._n_disp[d] -= 1
+        if not self._n_disp[d]:
+            del self._disp_ids[self._nomes_disp[d]]
+            self._nomes_disp[d] = None
+            self._livres_disp.append(d)
+        return entrada
+
+    def __contains__(self, key) -> bool:
+        return key in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def keys(self):
+        return self._ids.keys()
+
+    def items(self):
+        n = len(self._chaves)
+        colunas = zip(self._chaves, zip(self._ts[:n].tolist(), self._nid[:n].tolist(), self._val[:n].tolist()))
+        return ((k, e) for k, e in colunas if k is not None)
+
+    def entradas(self, ids) -> List[Tuple[str, int, int, float]]:
+        """(chave, ts, node_id, valor) das posições `ids`."""
+        chaves = self._chaves
+        return [(chaves[i], ts, nid, val) for i, ts, nid, val in
+                zip(ids.tolist(), self._ts[ids].tolist(), self._nid[ids].tolist(), self._val[ids].tolist())]
+
+    def vivas(self):
+        """Máscara das posições ocupadas."""
+        return self._ts[:len(self._chaves)] != _TS_VAZIO
+
+    def aplicar_colunas(self, keys: List[str], ts, nid, val):
+        """Aplica um lote em colunas com comparações LWW vetorizadas. Devolve
+        os ids das entradas que venceram e as colunas (ts, node_id, valor) que
+        elas tinham antes (ts = _TS_VAZIO para chave nova)."""
+        n = len(keys)
+        ids = np.fromiter(map(self._ids.get, keys, repeat(-1)), np.int64, n)
+        if (ids < 0).any(): ids = self._internar_lote(keys)
+        ts, nid, val = np.asarray(ts, np.int64), np.asarray(nid, np.int64), np.asarray(val, np.float64)
+        # dentro do lote vale a maior (ts, node_id) de cada chave; em empate, a
+        # primeira ocorrência, como no merge entrada a entrada
+        ordem = np.lexsort((np.arange(n)[::-1], nid, ts, ids))
+        ultimo = np.ones(n, bool)
+        ultimo[:-1] = ids[ordem[1:]] != ids[ordem[:-1]]
+        sel = ordem[ultimo]
+        ids, ts, nid, val = ids[sel], ts[sel], nid[sel], val[sel]
+        cur_ts, cur_nid = self._ts[ids], self._nid[ids]
+        vence = (ts > cur_ts) | ((ts == cur_ts) & (nid > cur_nid))
+        ids = ids[vence]
+        antigos = (cur_ts[vence], cur_nid[vence], self._val[ids])
+        self._ts[ids], self._nid[ids], self._val[ids] = ts[vence], nid[vence], val[vence]
+        return ids, antigos
+
+class LWWMapColunar(LWWMap):
+    """LWWMap sobre ColunasLWW: cerca de um terço da memória por chave e
+    `merge_many` vetorizado. Versões, hashes de Merkle e índice por
+    dispositivo ficam nas colunas e são atualizados por lote; só o hash de
+    cada entrada vencedora é calculado um a um. Em troca, delta_desde,
+    entradas_baldes e as leituras por dispositivo varrem as colunas (O(n)
+    vetorizado) em vez de seguir um índice."""
+    def __init__(self, shards: int = 16, metricas: Optional[MetricasNo] = None,
+                 ttl: Optional[PoliticaTTL] = None, max_chaves: int = 0,
+                 historico: Optional["HistoricoLWW"] = None):
+        if np is None: raise ValueError("LWW_BACKEND=colunar requer NumPy")
+        super().__init__(shards, metricas, ttl, max_chaves, historico)
+        self._state = ColunasLWW()
+        # substituídos pelas colunas _ver, _folha, _balde e _disp
+        del self._alteracoes, self._folhas, self._baldes, self._por_disp
+
+    def _tocar_disp(self, disp: str, versao: int):
+        if disp not in self._versao_disp: bisect.insort(self._disps, disp)
+        self._versao_disp[disp] = versao
+
+    def _registrar(self, key: str, antigo: Optional[Tuple[int, int, float]], novo: Tuple[int, int, float]):
+        if self._vistas: self._guardar_antigo(key, antigo)
+        c = self._state
+        i = c._ids[key]
+        self._versao = versao = self._versao + 1
+        c._ver[i] = versao
+        folha = _hash_entrada(key.encode(), *novo)
+        self._arvore[MERKLE_FOLHAS + int(c._balde[i])] ^= folha ^ int(c._folha[i])
+        c._folha[i] = folha
+        self._arvore_suja = True
+        self._tocar_disp(c._nomes_disp[c._disp[i]], versao)
+        self._acompanhar(key, novo)
+
+    def _remover(self, key: str, motivo: str):
+        c = self._state
+        i = c._ids[key]
+        b, folha, disp = int(c._balde[i]), int(c._folha[i]), c._nomes_disp[c._disp[i]]
+        antigo = c.pop(key)
+        if self._vistas: self._guardar_antigo(key, antigo)
+        self._versao += 1
+        self._arvore[MERKLE_FOLHAS + b] ^= folha
+        self._arvore_suja = True
+        if disp in c._disp_ids:
+            self._versao_disp[disp] = self._versao
+        else:
+            del self._versao_disp[disp]
+            del self._disps[bisect.bisect_left(self._disps, disp)]
+        if self.historico is not None: self.historico.remover(key)
+        if self.metricas: self.metricas.despejos.inc(motivo=motivo)
+
+    def _aplicar_colunas(self, keys, ts, nid, val):
+        if not len(keys): return
+        c = self._state
+        ids, (ant_ts, ant_nid, ant_val) = c.aplicar_colunas(keys, ts, nid, val)
+        n = len(ids)
+        if not n: return
+        chaves = [c._chaves[i] for i in ids.tolist()]
+        if self._vistas:
+            for k, a in zip(chaves, zip(ant_ts.tolist(), ant_nid.tolist(), ant_val.tolist())):
+                self._guardar_antigo(k, None if a[0] == _TS_VAZIO else a)
+        ts, nid, val = c._ts[ids].tolist(), c._nid[ids].tolist(), c._val[ids].tolist()
+        versoes = np.arange(self._versao + 1, self._versao + n + 1, dtype=np.int64)
+        self._versao += n
+        c._ver[ids] = versoes
+        folhas = np.fromiter(map(_hash_entrada, (k.encode() for k in chaves), ts, nid, val), np.uint64, n)
+        delta = np.zeros(MERKLE_FOLHAS, np.uint64)
+        np.bitwise_xor.at(delta, c._balde[ids], folhas ^ c._folha[ids])
+        c._folha[ids] = folhas
+        for b in np.flatnonzero(delta).tolist():
+            self._arvore[MERKLE_FOLHAS + b] ^= int(delta[b])
+        self._arvore_suja = True
+        # versão de cada dispositivo tocado = a da sua última entrada no lote
+        disps, ultima = np.unique(c._disp[ids][::-1], return_index=True)
+        for d, v in zip(disps.tolist(), versoes[n - 1 - ultima].tolist()):
+            self._tocar_disp(c._nomes_disp[d], v)
+        if self.ttl is not None or self.max_chaves or self.historico is not None:
+            for k, novo in zip(chaves, zip(ts, nid, val)): self._acompanhar(k, novo)
+
+    def _aplicar_lote(self, items: Iterable[Tuple[str, int, int, float]]):
+        items = list(items)
+        if items: self._aplicar_colunas(*zip(*items))
+
+    def _ts_desde(self, versao: int) -> List[int]:
+        c = self._state
+        return c._ts[np.flatnonzero(c._ver[:len(c._chaves)] > versao)].tolist()
+
+    async def delta_desde(self, versao: int) -> Tuple[List[Tuple[str, int, int, float]], int]:
+        c = self._state
+        ver = c._ver[:len(c._chaves)]
+        sel = np.flatnonzero(ver > versao)
+        return c.entradas(sel[np.argsort(-ver[sel])]), self._versao
+
+    async def entradas_baldes(self, baldes: Iterable[int]) -> List[Tuple[str, int, int, float]]:
+        c = self._state
+        sel = np.isin(c._balde[:len(c._chaves)], np.fromiter(baldes, np.int32)) & c.vivas()
+        return c.entradas(np.flatnonzero(sel))
+
+    def versao_chave(self, key: str) -> int:
+        i = self._state._ids.get(key)
+        return 0 if i is None else int(self._state._ver[i])
+
+    async def agrupar(self, disps: Iterable[str]) -> Dict[str, Dict[str, Tuple[int, int, float]]]:
+        c = self._state
+        grupos = {d: {} for d in disps if d in c._disp_ids}
+        if not grupos: return {}
+        pedidos = np.fromiter((c._disp_ids[d] for d in grupos), np.int32, len(grupos))
+        sel = np.flatnonzero(np.isin(c._disp[:len(c._chaves)], pedidos) & c.vivas())
+        for k, ts, nid, val in c.entradas(sel):
+            disp, met = dividir_chave(k)
+            grupos[disp][met] = (ts, nid, val)
+        return grupos
+
+# ------------------ Histórico por chave ------------------
+class _Anel:
+    """`capacidade` pares (ts, valor) por slot, contíguos em arrays tipados."""
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self.ts, self.val = array("q"), array("d")
+        self.pos, self.cont = array("q"), array("q")
+
+    def crescer(self):
+        self.ts.frombytes(bytes(8 * self.capacidade))
+        self.val.frombytes(bytes(8 * self.capacidade))
+        self.pos.append(0)
+        self.cont.append(0)
+
+    def limpar(self, slot: int):
+        self.pos[slot] = self.cont[slot] = 0
+
+    def inserir(self, slot: int, ts: int, val: float):
+        p = self.pos[slot]
+        i = slot * self.capacidade + p
+        self.ts[i], self.val[i] = ts, val
+        self.pos[slot] = (p + 1) % self.capacidade
+        if self.cont[slot] < self.capacidade: self.cont[slot] += 1
+
+    def pontos(self, slot: int, desde: int = 0, ate: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Do mais antigo ao mais novo, com desde <= ts < ate."""
+        cap, c = self.capacidade, self.cont[slot]
+        base, inicio = slot * cap, (self.pos[slot] - c) % cap
+        saida = []
+        for j in range(c):
+            i = base + (inicio + j) % cap
+            ts = self.ts[i]
+            if ts >= desde and (ate is None or ts < ate): saida.append((ts, self.val[i]))
+        return saida
+
+class HistoricoLWW:
+    """Histórico recente dos valores aceitos por chave, sem um objeto Python por
+    ponto: um anel de `capacidade` amostras brutas por chave e, para cada nível
+    (passo_s, janelas), um anel com a média de cada janela de passo_s segundos,
+    cobrindo o passado que o anel bruto já sobrescreveu."""
+    def __init__(self, capacidade: int = 120, niveis: Iterable[Tuple[float, int]] = ((60, 60), (3600, 24))):
+        self.niveis = [(int(passo * 1000), janelas) for passo, janelas in niveis]
+        self._slots: Dict[str, int] = {}
+        self._livres: List[int] = []
+        self._bruto = _Anel(capacidade)
+        self._aneis = [_Anel(janelas) for _, janelas in self.niveis]
+        # janela aberta de cada nível, por slot: início, soma e número de amostras
+        self._abertas = [(array("q"), array("d"), array("q")) for _ in self.niveis]
+
+    def _slot(self, key: str) -> int:
+        slot = self._slots.get(key)
+        if slot is not None: return slot
+        if self._livres:
+            slot = self._livres.pop()
+            self._bruto.limpar(slot)
+            for anel in self._aneis: anel.limpar(slot)
+            for _, _, n in self._abertas: n[slot] = 0
+        else:
+            slot = len(self._bruto.pos)
+            self._bruto.crescer()
+            for anel in self._aneis: anel.crescer()
+            for inicio, soma, n in self._abertas:
+                inicio.append(0); soma.append(0.0); n.append(0)
+        self._slots[key] = slot
+        return slot
+
+    def registrar(self, key: str, ts: int, val: float):
+        slot = self._slot(key)
+        self._bruto.inserir(slot, ts, val)
+        for (passo, _), anel, (inicio, soma, n) in zip(self.niveis, self._aneis, self._abertas):
+            ini = ts - ts % passo
+            if n[slot] and ini != inicio[slot]:
+                anel.inserir(slot, inicio[slot], soma[slot] / n[slot])
+                n[slot], soma[slot] = 0, 0.0
+            inicio[slot] = ini
+            soma[slot] += val
+            n[slot] += 1
+
+    def remover(self, key: str):
+        slot = self._slots.pop(key, None)
+        if slot is not None: self._livres.append(slot)
+
+    def consultar(self, key: str, desde_ms: int) -> Optional[dict]:
+        """Amostras brutas com ts >= desde_ms e, para o trecho mais antigo que o
+        anel bruto não cobre, as médias de cada nível (inclusive a janela aberta)."""
+        slot = self._slots.get(key)
+        if slot is None: return None
+        brutos = self._bruto.pontos(slot, desde_ms)
+        limite = brutos[0][0] if brutos else None
+        janelas = {}
+        for (passo, _), anel, (inicio, soma, n) in zip(self.niveis, self._aneis, self._abertas):
+            if self._bruto.cont[slot] < self._bruto.capacidade:
+                janelas[passo // 1000] = []  # o anel bruto ainda tem tudo
+                continue
+            pontos = anel.pontos(slot, desde_ms - passo + 1, limite)
+            if n[slot] and inicio[slot] > desde_ms - passo and (limite is None or inicio[slot] < limite):
+                pontos.append((inicio[slot], soma[slot] / n[slot]))
+            janelas[passo // 1000] = pontos
+        return {"brutos": brutos, "janelas": janelas}
+
+# ------------------ Formato binário de gossip ------------------
+# Corpo = sequência de quadros independentes. Cada quadro:
+#   cabeçalho "<4sII": magia, n entradas, tamanho do dicionário de chaves
+#   dicionário: chaves utf-8 separadas por "\n"
+#   colunas little-endian: ts int64[n], node_id int64[n], valor float64[n]
+TIPO_JSON = "application/json"
+TIPO_BIN = "application/x-lww-bin"
+_MAGIA = b"LWW1"
+_CAB = struct.Struct("<4sII")
+_QUADRO_MAX = 4096
+_BIG_ENDIAN = sys.byteorder == "big"
+
+def _coluna(tipo: str, valores) -> bytes:
+    col = array(tipo, valores)
+    if _BIG_ENDIAN: col.byteswap()
+    return col.tobytes()
+
+def _validar_chave(key) -> str:
+    """Chaves viajam em UTF-8, separadas por "\n", no dicionário dos quadros
+    binários: uma chave com quebra de linha ou surrogate solto (aceito pelo
+    JSON) não poderia ser reenviada a peers binários."""
+    if not isinstance(key, str) or "\n" in key: raise ValueError(f"chave inválida: {key!r}")
+    key.encode()  # UnicodeEncodeError também é ValueError
+    return key
+
+def codificar_binario(items: List[Tuple[str, int, int, float]]) -> bytes:
+    partes = []
+    for i in range(0, len(items), _QUADRO_MAX):
+        bloco = items[i:i + _QUADRO_MAX]
+        keys, tss, nids, vals = zip(*bloco)
+        dic = "\n".join(keys).encode()
+        if dic.count(b"\n") != len(bloco) - 1:
+            raise ValueError("chave com quebra de linha não cabe no formato binário")
+        partes += [_CAB.pack(_MAGIA, len(bloco), len(dic)), dic,
+                   _coluna("q", tss), _coluna("q", nids), _coluna("d", vals)]
+    return b"".join(partes)
+
+def _ler_coluna(tipo: str, buf, ini: int, n: int) -> array:
+    col = array(tipo)
+    col.frombytes(buf[ini:ini + 8 * n])
+    if _BIG_ENDIAN: col.byteswap()
+    return col
+
+def quadros_binarios(buf: bytes) -> Iterator[Tuple[List[str], array, array, array]]:
+    """Decodifica o corpo binário quadro a quadro, em colunas (chaves, ts, node_id, valor)."""
+    mv = memoryview(buf)
+    pos = 0
+    while pos < len(mv):
+        magia, n, tam_dic = _CAB.unpack_from(mv, pos)
+        if magia != _MAGIA: raise ValueError("quadro binário inválido")
+        pos += _CAB.size
+        keys = str(mv[pos:pos + tam_dic], "utf-8").split("\n") if n else []
+        if len(keys) != n or pos + tam_dic + 24 * n > len(mv):
+            raise ValueError("quadro binário truncado")
+        pos += tam_dic
+        tss = _ler_coluna("q", mv, pos, n); pos += 8 * n
+        nids = _ler_coluna("q", mv, pos, n); pos += 8 * n
+        vals = _ler_coluna("d", mv, pos, n); pos += 8 * n
+        yield keys, tss, nids, vals
+
+def decodificar_binario(buf: bytes) -> List[Tuple[str, int, int, float]]:
+    items: List[Tuple[str, int, int, float]] = []
+    for keys, tss, nids, vals in quadros_binarios(buf):
+        items.extend(zip(keys, tss.tolist(), nids.tolist(), vals.tolist()))
+    return items
+
+# ------------------ Leitura em fluxo ------------------
+# O corpo do gossip é decodificado enquanto chega: só um quadro binário (ou um
+# pedaço de JSON mais um elemento) fica em memória, qualquer que seja o tamanho
+# da sincronização.
+_PEDACO = 1 << 16
+_DIC_MAX = _QUADRO_MAX * 1024  # dicionário de chaves de um quadro: até 4 MiB
+
+async def pedacos_corpo(corpo: bytes, deflate: bool = False) -> AsyncIterator[bytes]:
+    """Pedaços de um corpo já em memória, descomprimindo deflate aos poucos
+    (usado fora do HTTP, ex.: transporte da simulação)."""
+    d = zlib.decompressobj() if deflate else None
+    for i in range(0, len(corpo), _PEDACO):
+        p = corpo[i:i + _PEDACO]
+        if d is None:
+            yield p
+            continue
+        while p:
+            saida = d.decompress(p, _PEDACO)
+            p = d.unconsumed_tail
+            if saida: yield saida
+    if d is not None:
+        resto = d.flush()
+        if resto: yield resto
+
+class Fluxo:
+    """Leitura incremental de um corpo entregue em pedaços de bytes."""
+    def __init__(self, pedacos: AsyncIterator[bytes]):
+        self._pedacos = pedacos.__aiter__()
+        self._buf = bytearray()
+        self.lidos = 0
+
+    async def _encher(self) -> bool:
+        try: p = await self._pedacos.__anext__()
+        except StopAsyncIteration: return False
+        self._buf += p
+        self.lidos += len(p)
+        return True
+
+    async def esgotado(self) -> bool:
+        while not self._buf:
+            if not await self._encher(): return True
+        return False
+
+    async def exatos(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            if not await self._encher(): raise ValueError("corpo truncado")
+        dados = bytes(self._buf[:n])
+        del self._buf[:n]
+        return dados
+
+    async def pedaco(self) -> bytes:
+        """O que já está no buffer ou o próximo pedaço; b"" no fim."""
+        if not self._buf and not await self._encher(): return b""
+        dados, self._buf = bytes(self._buf), bytearray()
+        return dados
+
+async def quadros_binarios_fluxo(fluxo: Fluxo) -> AsyncIterator[Tuple[List[str], array, array, array]]:
+    """Como quadros_binarios, lendo um quadro de cada vez do fluxo."""
+    while not await fluxo.esgotado():
+        magia, n, tam_dic = _CAB.unpack(await fluxo.exatos(_CAB.size))
+        if magia != _MAGIA: raise ValueError("quadro binário inválido")
+        if n > _QUADRO_MAX or tam_dic > _DIC_MAX: raise ValueError("quadro binário grande demais")
+        quadro = await fluxo.exatos(tam_dic + 24 * n)
+        for q in quadros_binarios(_CAB.pack(magia, n, tam_dic) + quadro):
+            yield q
+
+_JSON = json.JSONDecoder()
+_ESPACOS = " \t\n\r"
+
+class _LeitorJson:
+    def __init__(self, fluxo: Fluxo):
+        self.fluxo = fluxo
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf, self.pos, self.fim = "", 0, False
+
+    async def _mais(self) -> bool:
+        if self.fim: return False
+        p = await self.fluxo.pedaco()
+        self.fim = not p
+        self.buf = self.buf[self.pos:] + self._utf8.decode(p, final=self.fim)
+        self.pos = 0
+        return True
+
+    async def simbolo(self) -> str:
+        """Próximo caractere fora de espaços, sem consumi-lo ("" no fim)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _ESPACOS: self.pos += 1
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if not await self._mais(): return ""
+
+    async def valor(self):
+        await self.simbolo()
+        while True:
+            try:
+                v, fim = _JSON.raw_decode(self.buf, self.pos)
+                # um número no fim do buffer pode continuar no próximo pedaço
+                if fim < len(self.buf) or self.fim:
+                    self.pos = fim
+                    return v
+            except json.JSONDecodeError:
+                if self.fim: raise
+            await self._mais()
+
+    async def itens(self, lista: str) -> AsyncIterator:
+        """Elementos de {lista: [...]} um a um; as demais chaves são descartadas."""
+        if await self.simbolo() != "{": raise ValueError("corpo JSON deve ser um objeto")
+        self.pos += 1
+        while True:
+            c = await self.simbolo()
+            if c == "}": return
+            if c == "": raise ValueError("JSON truncado")
+            if c == ",":
+                self.pos += 1
+                continue
+            chave = await self.valor()
+            if await self.simbolo() != ":": raise ValueError("JSON inválido: falta ':'")
+            self.pos += 1
+            if chave != lista or await self.simbolo() != "[":
+                await self.valor()
+                continue
+            self.pos += 1
+            while True:
+                c = await self.simbolo()
+                if c == "]":
+                    self.pos += 1
+                    break
+                if c == "": raise ValueError("JSON truncado")
+                if c == ",":
+                    self.pos += 1
+                    continue
+                yield await self.valor()
+
+def itens_json_fluxo(fluxo: Fluxo, lista: str = "lww") -> AsyncIterator:
+    return _LeitorJson(fluxo).itens(lista)
 
 # ------------------ Logging helpers ------------------
 def configurar_logger(porta: int) -> logging.Logger:
@@ -47,7 +1093,12 @@ def configurar_logger(porta: int) -> logging.Logger:
     fmt = logging.Formatter("%(asctime)s %(message)s", "%Y-%m-%d %H:%M:%S,%f")
     logger.handlers.clear()
     fh.setFormatter(fmt)
-    logger.addHandler(fh)
+    # a escrita em arquivo roda numa thread de fundo; o event loop só enfileira
+    fila: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(fila))
+    ouvinte = logging.handlers.QueueListener(fila, fh)
+    ouvinte.start()
+    atexit.register(ouvinte.stop)
     return logger
 
 def _key_disp_ordem(nome: str):
@@ -56,116 +1107,1015 @@ def _key_disp_ordem(nome: str):
         if suf.isdigit(): return (0, int(suf))
     return (1, nome)
 
-def _group_by_device(state: Dict[str, Tuple[int, int, float]]) -> DefaultDict[str, Dict[str, Tuple[float, int, int]]]:
-    grouped: DefaultDict[str, Dict[str, Tuple[float, int, int]]] = defaultdict(dict)
-    for k, (ts, nid, val) in state.items():
-        if ":" in k: disp, met = k.split(":", 1)
-        else: disp, met = k, "valor"
-        grouped[disp][met] = (float(val), ts, nid)
+def _group_by_device(state: Dict[str, Tuple[int, int, float]]) -> DefaultDict[str, Dict[str, Tuple[int, int, float]]]:
+    grouped: DefaultDict[str, Dict[str, Tuple[int, int, float]]] = defaultdict(dict)
+    for k, entrada in state.items():
+        disp, met = dividir_chave(k)
+        grouped[disp][met] = entrada
     return grouped
 
-def log_estado(logger: logging.Logger, state: Dict[str, Tuple[int, int, float]], titulo: str):
-    grouped = _group_by_device(state)
-    logger.info(f"[ESTADO] {titulo} — {len(grouped)} dispositivos")
+def _log_dispositivos(logger: logging.Logger, grouped, rotulo: str):
     for disp in sorted(grouped.keys(), key=_key_disp_ordem):
         parts = []
         for met in sorted(grouped[disp].keys()):
-            val, ts, nid = grouped[disp][met]
+            ts, nid, val = grouped[disp][met]
             parts.append(f"{met}={val:.2f}@{ts} nid={nid}")
-        logger.info(f"[ESTADO] {disp}: " + ", ".join(parts))
+        logger.info(f"[{rotulo}] {disp}: " + ", ".join(parts))
+
+def log_estado(logger: logging.Logger, grouped: Dict[str, Dict[str, Tuple[int, int, float]]], titulo: str):
+    logger.info(f"[ESTADO] {titulo} — {len(grouped)} dispositivos")
+    _log_dispositivos(logger, grouped, "ESTADO")
+
+class RegistroEstado:
+    """Log de estado com custo proporcional às mudanças: a cada chamada grava
+    só as chaves alteradas desde o último registro ([DELTA]) e, no máximo uma
+    vez a cada `intervalo_dump` segundos, o estado completo ([ESTADO])."""
+    def __init__(self, logger: logging.Logger, crdt: "LWWMap", intervalo_dump: float = 30.0):
+        self.logger = logger
+        self.crdt = crdt
+        self.intervalo_dump = intervalo_dump
+        self._versao = 0
+        self._ultimo_dump = float("-inf")
+
+    async def registrar(self, titulo: str):
+        if not self.logger.isEnabledFor(logging.INFO): return
+        agora = time.monotonic()
+        if agora - self._ultimo_dump >= self.intervalo_dump:
+            self._ultimo_dump = agora
+            self._versao = self.crdt.versao
+            log_estado(self.logger, await self.crdt.agrupar(self.crdt.faixa_dispositivos()), titulo)
+            return
+        items, self._versao = await self.crdt.delta_desde(self._versao)
+        if not items: return
+        grouped = _group_by_device({k: (ts, nid, val) for k, ts, nid, val in items})
+        self.logger.info(f"[DELTA] {titulo} — {len(items)} chaves em {len(grouped)} dispositivos")
+        _log_dispositivos(self.logger, grouped, "DELTA")
+
+# ------------------ Persistência: WAL + snapshot ------------------
+# diretório LWW_DADOS:
+#   snapshot.bin  quadros do formato binário com o estado completo
+#   wal.bin       registros "<I" tamanho + quadros, com as alterações desde o snapshot
+#   epoca         época do nó; reaproveitada quando o estado é restaurado
+#   encerrado     marca de encerramento limpo, apagada enquanto o nó roda
+_REG = struct.Struct("<I")
+
+class Persistencia:
+    """Grava no WAL, em lotes, as alterações aplicadas desde a última gravação
+    (lidas pelas versões do LWWMap, então cada chave sai uma vez por lote) e faz
+    um fsync por lote. A cada `intervalo_snapshot` compacta o estado num
+    snapshot e recomeça o WAL. Na partida, o snapshot é lido via mmap."""
+    def __init__(self, diretorio: str, crdt: LWWMap, logger: logging.Logger,
+                 intervalo_fsync: float = 0.2, intervalo_snapshot: float = 60.0):
+        self.diretorio = diretorio
+        self.crdt = crdt
+        self.logger = logger
+        self.intervalo_fsync = intervalo_fsync
+        self.intervalo_snapshot = intervalo_snapshot
+        self._versao = 0
+        self._caminho_wal = os.path.join(diretorio, "wal.bin")
+        self._caminho_snap = os.path.join(diretorio, "snapshot.bin")
+        self._caminho_epoca = os.path.join(diretorio, "epoca")
+        self._caminho_encerrado = os.path.join(diretorio, "encerrado")
+        os.makedirs(diretorio, exist_ok=True)
+
+    async def carregar(self, epoca: str) -> str:
+        """Restaura snapshot + WAL e devolve a época a usar: a gravada, se havia
+        estado e o último encerramento foi limpo, ou `epoca`. Após uma queda o
+        gossip já confirmado aos peers pode não ter chegado ao WAL (fsync em
+        lote), então a época nova os faz reenviar o estado completo.
+        Registros truncados no fim do WAL são ignorados."""
+        t0 = time.perf_counter()
+        if os.path.exists(self._caminho_snap) and os.path.getsize(self._caminho_snap):
+            with open(self._caminho_snap, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                mv = memoryview(mm)
+                try:
+                    for quadro in quadros_binarios(mv):
+                        await self.crdt.merge_colunas(*quadro, remoto=False)
+                finally:
+                    mv.release()
+        if os.path.exists(self._caminho_wal):
+            with open(self._caminho_wal, "rb") as f:
+                buf = f.read()
+            pos = 0
+            while pos + _REG.size <= len(buf):
+                (tam,) = _REG.unpack_from(buf, pos)
+                if pos + _REG.size + tam > len(buf): break
+                registro = buf[pos + _REG.size:pos + _REG.size + tam]
+                for quadro in quadros_binarios(registro):
+                    await self.crdt.merge_colunas(*quadro, remoto=False)
+                pos += _REG.size + tam
+        self._versao = self.crdt.versao
+        if self._versao and os.path.exists(self._caminho_epoca) and os.path.exists(self._caminho_encerrado):
+            with open(self._caminho_epoca) as f:
+                epoca = f.read().strip() or epoca
+        else:
+            if self._versao:
+                self.logger.warning("[DURAVEL] Encerramento anterior não foi limpo; nova época")
+            self._gravar_atomico(self._caminho_epoca, epoca.encode())
+        if os.path.exists(self._caminho_encerrado):
+            os.remove(self._caminho_encerrado)
+        if self._versao:
+            self.logger.info(f"[DURAVEL] Estado restaurado: {self._versao} entradas em "
+                             f"{(time.perf_counter() - t0) * 1000:.1f} ms")
+        return epoca
+
+    @staticmethod
+    def _gravar_atomico(caminho: str, dados: bytes):
+        tmp = caminho + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(dados)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, caminho)
+
+    def _anexar_wal(self, dados: bytes):
+        with open(self._caminho_wal, "ab", buffering=0) as f:
+            ini = f.tell()
+            try:
+                mv = memoryview(dados)
+                while mv: mv = mv[f.write(mv):]
+                os.fsync(f.fileno())
+            except OSError:
+                f.truncate(ini)  # sem registro pela metade no meio do WAL
+                raise
+
+    def _codificar(self, items: List[Tuple[str, int, int, float]]) -> bytes:
+        """Entradas que o formato binário não representa ficam fora do disco,
+        com aviso, em vez de barrar a gravação das demais."""
+        try:
+            return codificar_binario(items)
+        except ValueError:
+            validos = []
+            for item in items:
+                try:
+                    _validar_chave(item[0])
+                    validos.append(item)
+                except ValueError:
+                    self.logger.warning(f"[DURAVEL] Entrada não gravada, chave inválida: {item[0]!r}")
+            return codificar_binario(validos) if validos else b""
+
+    async def gravar_wal(self):
+        items, versao = await self.crdt.delta_desde(self._versao)
+        if not items: return
+        corpo = self._codificar(items)
+        await asyncio.to_thread(self._anexar_wal, _REG.pack(len(corpo)) + corpo)
+        self._versao = versao
+
+    async def gravar_snapshot(self):
+        items, versao = await self.crdt.delta_desde(0)
+        corpo = self._codificar(items) if items else b""
+        await asyncio.to_thread(self._gravar_atomico, self._caminho_snap, corpo)
+        # o snapshot cobre tudo até `versao`; o WAL recomeça com o que veio depois.
+        # Se cair entre as duas etapas, reaplicar o WAL antigo é idempotente (LWW).
+        self._versao = versao
+        await asyncio.to_thread(self._gravar_atomico, self._caminho_wal, b"")
+        await self.gravar_wal()
+
+    async def encerrar(self):
+        """Grava o último lote e marca o encerramento como limpo."""
+        await self.gravar_wal()
+        await asyncio.to_thread(self._gravar_atomico, self._caminho_encerrado, b"")
+
+    async def executar(self):
+        ultimo_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(self.intervalo_fsync)
+            try:
+                if time.monotonic() - ultimo_snapshot >= self.intervalo_snapshot:
+                    ultimo_snapshot = time.monotonic()
+                    await self.gravar_snapshot()
+                else:
+                    await self.gravar_wal()
+            except Exception:
+                # ex.: disco cheio. _versao só avança depois de gravar, então o
+                # próximo lote leva de novo o que ficou de fora
+                self.logger.exception("[DURAVEL] Falha ao gravar; nova tentativa no próximo lote")
+
+# ------------------ Particionamento: anel de hash consistente ------------------
+def _hash_anel(texto: str) -> int:
+    return int.from_bytes(hashlib.blake2b(texto.encode(), digest_size=8).digest(), "big")
+
+class AnelConsistente:
+    """Cada nó ocupa `vnodes` posições no anel; os donos de uma chave são os
+    `replicacao` primeiros nós distintos a partir do hash dela. Todos os nós
+    precisam da mesma lista (ANEL_NOS) para concordar sobre os donos."""
+    def __init__(self, nos: List[str], replicacao: int = 2, vnodes: int = 64):
+        self.nos = sorted(set(nos))
+        self.replicacao = max(1, min(replicacao, len(self.nos)))
+        pontos = sorted((_hash_anel(f"{no}#{i}"), no) for no in self.nos for i in range(vnodes))
+        self._posicoes = [p for p, _ in pontos]
+        self._nos_ponto = [no for _, no in pontos]
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+
+    _CACHE_MAX = 1 << 16  # donos memorizados; ao encher, o cache recomeça vazio
+
+    def donos(self, key: str) -> Tuple[str, ...]:
+        d = self._cache.get(key)
+        if d is None:
+            if len(self._cache) >= self._CACHE_MAX: self._cache.clear()
+            i = bisect.bisect(self._posicoes, _hash_anel(key))
+            donos: List[str] = []
+            while len(donos) < self.replicacao:
+                no = self._nos_ponto[i % len(self._nos_ponto)]
+                if no not in donos: donos.append(no)
+                i += 1
+            d = self._cache[key] = tuple(donos)
+        return d
 
 # ------------------ Tarefas ------------------
+def _marcar_repasse(app, keys: Iterable[str]):
+    """Modo particionado: chaves escritas aqui das quais este nó não é réplica
+    seguem para os donos pelo gossip e ficam em app["repasse"] até saírem."""
+    anel: Optional[AnelConsistente] = app["anel"]
+    if anel is None: return
+    eu, repasse = app["endereco"], app["repasse"]
+    for key in keys:
+        donos = anel.donos(key)
+        if eu not in donos: repasse[key] = donos
+
+async def _descartar_repassadas(app) -> int:
+    """Tira do estado as chaves repassadas cuja versão atual todos os donos já
+    confirmaram (ack); assim a memória do nó fica na sua fatia do anel."""
+    repasse: Dict[str, Tuple[str, ...]] = app["repasse"]
+    if not repasse: return 0
+    crdt: LWWMap = app["crdt"]
+    acks = {c.endereco: c.ack or 0 for c in app["peers"]}
+    prontas = []
+    for key, donos in repasse.items():
+        versao = crdt.versao_chave(key)  # 0: já saiu (TTL/limite)
+        if all(acks.get(d, 0) >= versao for d in donos): prontas.append(key)
+    for key in prontas: del repasse[key]
+    return await crdt.descartar(prontas, "repasse")
+
+async def escrever_local(app, lote: List[Tuple[str, int, int, float]]):
+    """Escritas deste nó (geração local e /ingest) num único put_many."""
+    await app["crdt"].put_many(lote)
+    _marcar_repasse(app, (k for k, _, _, _ in lote))
+    app["agenda"].notificar()
+
 async def gerar_metricas(app: web.Application):
     logger: logging.Logger = app["logger"]
-    crdt: LWWMap = app["crdt"]
     node_id: int = app["porta"]
     try:
         while True:
+            lote = []
             for disp in range(10):
                 for met in ("temperatura", "vibracao"):
                     key = f"disp{disp}:{met}"
                     ts = int(time.time() * 1000)
                     val = float(random.randint(0, 100))
-                    await crdt.put(key, ts, node_id, val)
+                    lote.append((key, ts, node_id, val))
                     logger.info(f"[LOCAL] {key} = {val:.2f} @ts={ts} nid={node_id}")
-            estado = await crdt.snapshot()
-            log_estado(logger, estado, "Após geração local")
-            await asyncio.sleep(0.5)
+            await escrever_local(app, lote)
+            await app["registro_estado"].registrar("Após geração local")
+            await asyncio.sleep(app["local_intervalo_s"])
     except asyncio.CancelledError:
         logger.info("[STOP] gerar_metricas cancelada")
         raise
 
+async def varrer_expirados(app: web.Application):
+    """Tira do mapa as entradas com TTL vencido; saem também do gossip e da árvore."""
+    logger: logging.Logger = app["logger"]
+    crdt: LWWMap = app["crdt"]
+    try:
+        while True:
+            await asyncio.sleep(app["varredura_s"])
+            n = await crdt.expirar()
+            if n: logger.info(f"[TTL] {n} chaves expiradas removidas")
+    except asyncio.CancelledError:
+        logger.info("[STOP] varrer_expirados cancelada")
+        raise
+
+class BufferIngestao:
+    """Escritas externas (POST /ingest) acumuladas por `janela` segundos. Em LWW
+    só a maior (ts, node_id) de cada chave sobrevive, então o buffer guarda uma
+    entrada por chave e a janela inteira vira um único put_many."""
+    def __init__(self, app: web.Application, janela: float, max_pendentes: int):
+        self.app = app
+        self.janela = janela
+        self.max_pendentes = max_pendentes
+        self._pendentes: Dict[str, Tuple[int, int, float]] = {}
+        self._recebidas = 0
+        self._aviso = asyncio.Event()
+
+    @property
+    def cheio(self) -> bool:
+        return len(self._pendentes) >= self.max_pendentes
+
+    def adicionar(self, key: str, ts: int, nid: int, val: float):
+        cur = self._pendentes.get(key)
+        if cur is None or LWWMap._maior((ts, nid), (cur[0], cur[1])):
+            self._pendentes[key] = (ts, nid, val)
+        self._recebidas += 1
+        self._aviso.set()
+
+    async def descarregar(self):
+        self._aviso.clear()
+        lote, self._pendentes = self._pendentes, {}
+        recebidas, self._recebidas = self._recebidas, 0
+        if not lote: return
+        metricas: MetricasNo = self.app["metricas"]
+        metricas.ingest_recebidas.inc(recebidas)
+        metricas.ingest_aplicadas.inc(len(lote))
+        await escrever_local(self.app, [(k, ts, nid, val) for k, (ts, nid, val) in lote.items()])
+        self.app["logger"].info(f"[INGEST] {recebidas} escritas coalescidas em {len(lote)} chaves")
+        await self.app["registro_estado"].registrar("Após ingestão")
+
+    async def executar(self):
+        try:
+            while True:
+                await self._aviso.wait()
+                await asyncio.sleep(self.janela)
+                await self.descarregar()
+        except asyncio.CancelledError:
+            self.app["logger"].info("[STOP] ingestão cancelada")
+            raise
+
+# ------------------ Transporte ------------------
+class TransporteHttp:
+    """Transporte real entre nós: HTTP via aiohttp com pool keep-alive
+    compartilhado (poucas conexões por peer, reaproveitadas entre rodadas).
+    A simulação (simulacao.py) troca esta classe por um transporte em memória."""
+    def __init__(self, concorrencia: int = 8, timeout: float = 3.0):
+        conector = aiohttp.TCPConnector(limit=concorrencia * 2, limit_per_host=2,
+                                        keepalive_timeout=30, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=conector)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def gossip(self, endereco: str, corpo: bytes, headers: Dict[str, str]) -> Tuple[Dict[str, str], Optional[dict]]:
+        """POST /gossip; devolve os headers e o JSON da resposta, se houver."""
+        async with self.session.post(f"http://{endereco}/gossip", data=corpo, headers=headers,
+                                     timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            try: dados = await resp.json(content_type=None)
+            except ValueError: dados = None
+            return dict(resp.headers), dados
+
+    async def digest(self, endereco: str, pedido: dict) -> dict:
+        async with self.session.post(f"http://{endereco}/digest", json=pedido, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def fechar(self):
+        await self.session.close()
+
+# Datagrama = cabeçalho "<4sBIB" (magia, tipo, seq, tamanho da origem) + carga:
+#   dados: ENDERECO do remetente (rótulo das métricas, como X-Gossip-Origem
+#          no HTTP) + um quadro do formato binário (cabe num pacote, sem fragmentar)
+#   ack:   época do receptor em ascii, enviado depois do merge
+_MAGIA_UDP = b"LWU2"
+_UDP_CAB = struct.Struct("<4sBIB")
+_UDP_DADOS, _UDP_ACK = 0, 1
+_UDP_MAX = 1200  # abaixo do MTU típico com folga para IP/UDP
+
+class TransporteUdp(asyncio.DatagramProtocol):
+    """Gossip de deltas pequenos em datagramas, no mesmo número de porta do
+    HTTP. Cada envio espera o ack do receptor por `timeout` segundos; sem ack
+    (perda, peer sem UDP), o envio volta ao POST /gossip na mesma rodada."""
+    def __init__(self, app: web.Application, timeout: float):
+        self.app = app
+        self.timeout = timeout
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._seq = 0
+        self._pendentes: Dict[int, asyncio.Future] = {}
+        self._enderecos: Dict[str, tuple] = {}
+        self._tarefas: set = set()
+        self._origem = app["endereco"].encode()[:255]
+        self.cabecalho = _UDP_CAB.size + len(self._origem)  # bytes antes do quadro
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def empacotar(self, items) -> Optional[bytes]:
+        """Quadro binário do delta, ou None se não couber num datagrama."""
+        if len(items) * 25 > _UDP_MAX: return None  # 24 bytes de colunas + chave
+        try: quadro = codificar_binario(items)
+        except ValueError: return None
+        return quadro if self.cabecalho + len(quadro) <= _UDP_MAX else None
+
+    async def _resolver(self, endereco: str) -> tuple:
+        addr = self._enderecos.get(endereco)
+        if addr is None:
+            host, _, porta = endereco.rpartition(":")
+            info = await asyncio.get_running_loop().getaddrinfo(
+                host, int(porta), family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            addr = self._enderecos[endereco] = info[0][4]
+        return addr
+
+    async def enviar(self, endereco: str, quadro: bytes) -> dict:
+        """Envia o quadro e devolve a resposta no formato do /gossip; TimeoutError sem ack."""
+        addr = await self._resolver(endereco)
+        self._seq = seq = (self._seq + 1) & 0xFFFFFFFF
+        fut = self._pendentes[seq] = asyncio.get_running_loop().create_future()
+        try:
+            cab = _UDP_CAB.pack(_MAGIA_UDP, _UDP_DADOS, seq, len(self._origem))
+            self.transport.sendto(cab + self._origem + quadro, addr)
+            epoca = await asyncio.wait_for(fut, self.timeout)
+        finally:
+            self._pendentes.pop(seq, None)
+        return {"ok": True, "epoca": epoca, "udp": True}
+
+    def datagram_received(self, dados: bytes, addr):
+        if len(dados) < _UDP_CAB.size: return
+        magia, tipo, seq, n_origem = _UDP_CAB.unpack_from(dados)
+        if magia != _MAGIA_UDP: return
+        carga = dados[_UDP_CAB.size:]
+        if tipo == _UDP_ACK:
+            fut = self._pendentes.get(seq)
+            if fut and not fut.done(): fut.set_result(carga.decode("ascii", "replace"))
+        elif tipo == _UDP_DADOS:
+            origem = carga[:n_origem].decode("utf-8", "replace") or f"{addr[0]}:{addr[1]}"
+            t = asyncio.create_task(self._receber(carga[n_origem:], seq, addr, origem, len(dados)))
+            self._tarefas.add(t)
+            t.add_done_callback(self._tarefas.discard)
+
+    async def _receber(self, quadro: bytes, seq: int, addr, origem: str, n_bytes: int):
+        app = self.app
+        total = 0
+        comp = _companheiro(app, origem)
+        try:
+            for q in quadros_binarios(quadro):
+                faixa = await app["crdt"].merge_colunas(*q)
+                if comp: comp.registrar_eco(faixa)
+                total += len(q[0])
+        except (ValueError, struct.error) as e:
+            # sem ack: o remetente reenvia por HTTP
+            app["logger"].info(f"[ERRO] Datagrama inválido de {origem}: {e}")
+            return
+        if self.transport is None or self.transport.is_closing(): return
+        self.transport.sendto(_UDP_CAB.pack(_MAGIA_UDP, _UDP_ACK, seq, 0) + app["epoca"].encode(), addr)
+        await _apos_receber(app, n_bytes, total, origem)
+
+    def fechar(self):
+        if self.transport: self.transport.close()
+        for t in self._tarefas: t.cancel()
+
+class Companheiro:
+    """Estado de gossip de um peer: última versão local confirmada por ele."""
+    def __init__(self, endereco: str):
+        self.endereco = endereco
+        self.ack: Optional[int] = None   # None => precisa de sincronização completa
+        self.falhas = 0
+        self.epoca: Optional[str] = None
+        self.ultimo_completo = 0.0  # monotonic da última sincronização completa
+        self.formato = TIPO_JSON  # passa a binário quando o peer anuncia suporte
+        self.udp = False  # o peer anunciou "udp" na resposta do /gossip
+        self.proxima_tentativa = 0.0  # circuito aberto até este instante (monotonic)
+        # faixas (início exclusivo, fim) de versões locais geradas pelo que o
+        # próprio peer mandou: essas entradas não voltam para ele no delta
+        self.ecos: List[Tuple[int, int]] = []
+
+    def registrar_eco(self, faixa: Tuple[int, int]):
+        ini, fim = faixa
+        if fim <= ini: return
+        if self.ecos and self.ecos[-1][1] == ini: self.ecos[-1] = (self.ecos[-1][0], fim)
+        else: self.ecos.append((ini, fim))
+
+    def eco(self, versao: int) -> bool:
+        """A entrada atual com esta versão veio do próprio peer."""
+        i = bisect.bisect_left(self.ecos, (versao,))
+        return i > 0 and versao <= self.ecos[i - 1][1]
+
+    def disponivel(self, agora: float) -> bool:
+        return agora >= self.proxima_tentativa
+
+    def registrar_falha(self, backoff_max: float):
+        """Backoff exponencial com jitter: 1, 2, 4, ... até backoff_max segundos."""
+        self.falhas += 1
+        espera = min(backoff_max, 2.0 ** (self.falhas - 1))
+        self.proxima_tentativa = time.monotonic() + random.uniform(espera / 2, espera)
+
+def _companheiro(app: web.Application, endereco: str) -> Optional[Companheiro]:
+    """Peer pelo ENDERECO que ele anuncia como origem do gossip."""
+    return next((c for c in app.get("peers", ()) if c.endereco == endereco), None)
+
+def _corpo_gossip(app: web.Application, comp: Companheiro, items) -> Tuple[bytes, Dict[str, str]]:
+    if comp.formato == TIPO_BIN:
+        corpo = codificar_binario(items)
+        headers = {"Content-Type": TIPO_BIN}
+        if app["gossip_compressao"] and len(corpo) >= 1024:
+            corpo = zlib.compress(corpo, 1)
+            headers["Content-Encoding"] = "deflate"
+        return corpo, headers
+    return json.dumps({"lww": items}).encode(), {"Content-Type": TIPO_JSON}
+
+async def _post_gossip(app: web.Application, comp: Companheiro, items) -> Optional[dict]:
+    """POST /gossip no formato negociado com o peer; devolve o JSON da resposta, se houver."""
+    corpo, headers = _corpo_gossip(app, comp, items)
+    # o receptor rotula o que recebe com o ENDERECO deste nó, o mesmo nome
+    # que ele usa em peer= ao enviar para cá
+    headers["X-Gossip-Origem"] = app["endereco"]
+    resp_headers, dados = await app["transporte"].gossip(comp.endereco, corpo, headers)
+    # como no UDP, só conta o que o peer recebeu
+    metricas: MetricasNo = app["metricas"]
+    metricas.enviado_bytes.inc(len(corpo), peer=comp.endereco)
+    metricas.enviado_entradas.inc(len(items), peer=comp.endereco)
+    # negociação: peers Python anunciam os formatos aceitos em Accept-Post
+    if app["gossip_formato"] == TIPO_BIN and TIPO_BIN in resp_headers.get("Accept-Post", ""):
+        comp.formato = TIPO_BIN
+    return dados if isinstance(dados, dict) else None
+
+async def _enviar_udp(app: web.Application, comp: Companheiro, items) -> Optional[dict]:
+    """Delta pequeno para peer com UDP: um datagrama. None => usar HTTP."""
+    udp: Optional[TransporteUdp] = app.get("udp")
+    if udp is None or not comp.udp: return None
+    quadro = udp.empacotar(items)
+    if quadro is None: return None
+    metricas: MetricasNo = app["metricas"]
+    try:
+        dados = await udp.enviar(comp.endereco, quadro)
+    except (asyncio.TimeoutError, OSError):
+        metricas.udp.inc(resultado="sem_ack")
+        return None
+    metricas.udp.inc(resultado="ack")
+    metricas.enviado_bytes.inc(udp.cabecalho + len(quadro), peer=comp.endereco)
+    metricas.enviado_entradas.inc(len(items), peer=comp.endereco)
+    return dados
+
+async def _enviar_gossip(app: web.Application, comp: Companheiro):
+    logger: logging.Logger = app["logger"]
+    crdt: LWWMap = app["crdt"]
+    # peers sem `epoca` (Go/Rust) não avisam que reiniciaram e ficam fora da
+    # anti-entropia: de tempos em tempos recebem o estado completo
+    resync = app["gossip_resync_s"]
+    if comp.epoca is None and resync > 0 and time.monotonic() - comp.ultimo_completo >= resync:
+        comp.ack = None
+    completo = comp.ack is None
+    # o peer pode ter reiniciado: no full sync vai tudo, inclusive o que veio dele
+    if completo: comp.ecos.clear()
+    items, versao = await crdt.delta_desde(0 if completo else comp.ack)
+    anel: Optional[AnelConsistente] = app["anel"]
+    if anel is not None:
+        # modo particionado: o peer só recebe as chaves das quais é réplica
+        items = [it for it in items if comp.endereco in anel.donos(it[0])]
+    if comp.ecos:
+        items = [it for it in items if not comp.eco(crdt.versao_chave(it[0]))]
+    if not items:
+        comp.ack = versao
+        return
+    try:
+        dados = await _enviar_udp(app, comp, items) or await _post_gossip(app, comp, items)
+    except Exception as e:
+        comp.registrar_falha(app["gossip_backoff_max_s"])
+        app["metricas"].falhas.inc(peer=comp.endereco)
+        # loga só a transição para falha, não a cada rodada
+        if comp.falhas == 1: logger.info(f"[ERRO] Envio gossip para {comp.endereco}: {e}")
+        # peer atrasado demais ou sem `epoca` (pode ter reiniciado sem que
+        # percebêssemos): volta ao full sync
+        if comp.epoca is None or comp.falhas >= app["gossip_falhas_full"]: comp.ack = None
+        return
+    if comp.falhas:
+        logger.info(f"[OK] {comp.endereco} voltou a responder após {comp.falhas} falhas")
+        comp.falhas = 0
+    comp.ack = versao
+    del comp.ecos[:bisect.bisect_left(comp.ecos, (versao,))]  # faixas já cobertas pelo ack
+    # peers Python devolvem a época do processo; se mudou, o peer reiniciou vazio
+    # ou voltou de uma queda sem o que ainda não estava no WAL
+    epoca = dados.get("epoca") if dados else None
+    if epoca is not None:
+        if comp.epoca is not None and epoca != comp.epoca:
+            comp.ack, comp.formato = None, TIPO_JSON
+        comp.epoca = epoca
+        comp.udp = bool(dados.get("udp"))
+    if completo:
+        comp.ultimo_completo = time.monotonic()
+        logger.info(f"[SYNC] Sincronização completa com {comp.endereco}: {len(items)} entradas")
+
+class AgendaGossip:
+    """Intervalo adaptativo entre rodadas de disseminar. Com `sujas` chaves
+    alteradas desde o início da última rodada, o intervalo é
+    base * alvo / (sujas + alvo), nunca abaixo de `minimo`; com o mapa parado e
+    todos os peers em dia, dobra a cada rodada até `maximo`. Se as alterações
+    chegam a `alvo` durante a espera, a rodada é antecipada. Jitter de ±20%
+    evita que os nós entrem em fase."""
+    def __init__(self, crdt: LWWMap, base: float, minimo: float, maximo: float, alvo: int):
+        self.crdt = crdt
+        self.minimo, self.maximo = minimo, max(minimo, maximo)
+        self.base = min(max(base, self.minimo), self.maximo)
+        self.alvo = max(1, alvo)
+        self.intervalo = self.base
+        self._versao = 0
+        self._acordar = asyncio.Event()
+
+    def sujas(self) -> int:
+        return self.crdt.versao - self._versao
+
+    def notificar(self):
+        """Chamado depois de escritas e merges: acorda disseminar se já há alvo sujas."""
+        if self.sujas() >= self.alvo: self._acordar.set()
+
+    def iniciar_rodada(self):
+        self._versao = self.crdt.versao
+
+    def descontar(self, n: int):
+        """Versões gastas em remoções locais não contam como alterações sujas."""
+        self._versao += n
+
+    def ajustar(self, em_dia: bool) -> float:
+        sujas = self.sujas()
+        if sujas:
+            self.intervalo = max(self.minimo, self.base * self.alvo / (sujas + self.alvo))
+        elif em_dia:
+            self.intervalo = min(self.maximo, self.intervalo * 2)
+        # parado mas com peer atrasado (em backoff): mantém o intervalo
+        return self.intervalo
+
+    async def esperar(self, em_dia: bool):
+        espera = self.ajustar(em_dia) * random.uniform(0.8, 1.2)
+        self._acordar.clear()
+        t0 = time.monotonic()
+        try: await asyncio.wait_for(self._acordar.wait(), espera)
+        except asyncio.TimeoutError: pass
+        resto = self.minimo - (time.monotonic() - t0)
+        if resto > 0: await asyncio.sleep(resto)
+
+def _escolher_peers(app: web.Application) -> List[Companheiro]:
+    """Peers fora de backoff; com GOSSIP_FANOUT=k, só k deles por rodada, ao acaso."""
+    agora = time.monotonic()
+    disponiveis = [c for c in app["peers"] if c.disponivel(agora)]
+    k = app["gossip_fanout"]
+    if 0 < k < len(disponiveis):
+        return random.sample(disponiveis, k)
+    return disponiveis
+
 async def disseminar(app: web.Application):
     logger: logging.Logger = app["logger"]
+    limite = asyncio.Semaphore(app["gossip_concorrencia"])
+
+    async def enviar(comp: Companheiro):
+        async with limite:
+            await _enviar_gossip(app, comp)
+
+    agenda: AgendaGossip = app["agenda"]
     crdt: LWWMap = app["crdt"]
-    companheiros: List[str] = app["companheiros"]
-    session: aiohttp.ClientSession = app["session"]
     try:
         while True:
-            estado = await crdt.snapshot()
-            items = [(k, ts, nid, val) for k, (ts, nid, val) in estado.items()]
-            payload = {"lww": items}
-            for c in companheiros:
-                url = f"http://{c}/gossip"
-                try:
-                    await session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=3))
-                except Exception as e:
-                    logger.info(f"[ERRO] Envio gossip para {c}: {e}")
-            await asyncio.sleep(2)
+            # envios concorrentes: um peer morto não atrasa a rodada dos outros
+            t0 = time.perf_counter()
+            agenda.iniciar_rodada()
+            await asyncio.gather(*(enviar(c) for c in _escolher_peers(app)))
+            app["metricas"].rodada_segundos.observar(time.perf_counter() - t0)
+            em_dia = all(c.ack == crdt.versao for c in app["peers"])
+            agenda.descontar(await _descartar_repassadas(app))
+            await agenda.esperar(em_dia)
+            app["metricas"].intervalo.definir(agenda.intervalo)
     except asyncio.CancelledError:
         logger.info("[STOP] disseminar cancelada")
         raise
 
+# ------------------ Anti-entropia (Merkle) ------------------
+_MERKLE_PASSO = 4  # níveis da árvore descidos por requisição de digest
+_PROFUNDIDADE = MERKLE_FOLHAS.bit_length() - 1
+
+def _descendentes(n: int) -> range:
+    k = min(_MERKLE_PASSO, _PROFUNDIDADE - (n.bit_length() - 1))
+    return range(n << k, (n + 1) << k)
+
+async def _digest(app: web.Application, comp: Companheiro, pedido: dict) -> dict:
+    return await app["transporte"].digest(comp.endereco, pedido)
+
+async def _reconciliar(app: web.Application, comp: Companheiro):
+    """Desce a árvore de Merkle só pelos ramos divergentes e troca apenas os
+    baldes cujas folhas diferem. Com os nós convergidos, custa um hash."""
+    crdt: LWWMap = app["crdt"]
+    nos, folhas = [1], []
+    while nos:
+        remotos = (await _digest(app, comp, {"nos": nos}))["hashes"]
+        locais = await crdt.hashes(nos)
+        divergentes = [n for n, a, b in zip(nos, locais, remotos) if a != b]
+        folhas += [n - MERKLE_FOLHAS for n in divergentes if n >= MERKLE_FOLHAS]
+        nos = [f for n in divergentes if n < MERKLE_FOLHAS for f in _descendentes(n)]
+    if not folhas: return
+    remoto = _coerce_items((await _digest(app, comp, {"baldes": folhas}))["lww"])
+    comp.registrar_eco(await crdt.merge_many(remoto))
+    # devolve ao peer só o que ele não tem ou tem mais antigo
+    vistos = {k: (ts, nid) for k, ts, nid, _ in remoto}
+    enviar = [(k, ts, nid, val) for k, ts, nid, val in await crdt.entradas_baldes(folhas)
+              if k not in vistos or LWWMap._maior((ts, nid), vistos[k])]
+    if enviar: await _post_gossip(app, comp, enviar)
+    app["logger"].info(f"[ANTI-ENTROPIA] {comp.endereco}: {len(folhas)} baldes divergentes, "
+                       f"recebidas {len(remoto)}, enviadas {len(enviar)}")
+
+async def anti_entropia(app: web.Application):
+    logger: logging.Logger = app["logger"]
+    try:
+        while True:
+            await asyncio.sleep(app["anti_entropia_s"])
+            # só peers Python (que informaram a época) expõem /digest
+            agora = time.monotonic()
+            for comp in app["peers"]:
+                if comp.epoca is None or not comp.disponivel(agora): continue
+                try: await _reconciliar(app, comp)
+                except Exception as e: logger.info(f"[ERRO] Anti-entropia com {comp.endereco}: {e}")
+    except asyncio.CancelledError:
+        logger.info("[STOP] anti_entropia cancelada")
+        raise
+
 # ------------------ HTTP ------------------
+def _coerce_item(x: Union[list, tuple, dict]) -> Tuple[str, int, int, float]:
+    if isinstance(x, dict):
+        return (_validar_chave(x["key"]), int(x["ts"]), int(x["node_id"]), float(x["value"]))
+    k, ts, nid, val = x
+    return (_validar_chave(str(k)), int(ts), int(nid), float(val))
+
 def _coerce_items(items_raw: List[Union[list, tuple, dict]]):
-    coerced = []
-    for x in items_raw:
-        if isinstance(x, dict):
-            coerced.append((x["key"], int(x["ts"]), int(x["node_id"]), float(x["value"])))
-        else:
-            k, ts, nid, val = x
-            coerced.append((str(k), int(ts), int(nid), float(val)))
-    return coerced
+    return [_coerce_item(x) for x in items_raw]
+
+_ACCEPT_POST = {"Accept-Post": f"{TIPO_BIN}, {TIPO_JSON}"}
+
+_LOTE_MERGE = _QUADRO_MAX
+
+async def receber_gossip(app: web.Application, pedacos: AsyncIterator[bytes], content_type: str, origem: str,
+                         tamanho: Optional[int] = None) -> dict:
+    """Aplica um corpo de gossip (JSON ou binário) à medida que chega, em lotes
+    de até _LOTE_MERGE entradas; ValueError se inválido. `tamanho` são os bytes
+    do corpo como vieram pela rede (comprimido, como o remetente os conta); sem
+    ele, conta o que foi lido de `pedacos`. Os locks são soltos entre lotes,
+    então escritas locais não esperam a sincronização inteira; se o corpo
+    quebrar no meio, os lotes já aplicados ficam (merge é idempotente)."""
+    crdt: LWWMap = app["crdt"]
+    comp = _companheiro(app, origem)
+    ecos = comp.registrar_eco if comp else lambda faixa: None
+    fluxo = Fluxo(pedacos)
+    total = 0
+    if content_type == TIPO_BIN:
+        # quadro a quadro, em colunas: o backend colunar faz o merge vetorizado
+        async for quadro in quadros_binarios_fluxo(fluxo):
+            ecos(await crdt.merge_colunas(*quadro))
+            total += len(quadro[0])
+            await asyncio.sleep(0)
+    else:
+        lote = []
+        async for x in itens_json_fluxo(fluxo):
+            lote.append(_coerce_item(x))
+            if len(lote) >= _LOTE_MERGE:
+                ecos(await crdt.merge_many(lote))
+                total += len(lote)
+                lote = []
+                await asyncio.sleep(0)
+        if lote:
+            ecos(await crdt.merge_many(lote))
+            total += len(lote)
+    await _apos_receber(app, fluxo.lidos if tamanho is None else tamanho, total, origem)
+    resposta = {"ok": True, "epoca": app["epoca"]}
+    if app.get("udp"): resposta["udp"] = True
+    return resposta
+
+async def _apos_receber(app: web.Application, n_bytes: int, total: int, origem: str):
+    metricas: MetricasNo = app["metricas"]
+    metricas.recebido_bytes.inc(n_bytes, peer=origem)
+    metricas.recebido_entradas.inc(total, peer=origem)
+    app["agenda"].notificar()
+    app["logger"].info(f"[REMOTO] Recebidas {total} entradas de {origem}")
+    await app["registro_estado"].registrar("Após merge remoto")
+
+async def responder_digest(app: web.Application, pedido: dict) -> dict:
+    """Anti-entropia: {"nos": [...]} -> hashes da árvore; {"baldes": [...]} -> entradas."""
+    crdt: LWWMap = app["crdt"]
+    if not isinstance(pedido, dict): raise ValueError("o pedido deve ser um objeto JSON")
+    if "baldes" in pedido:
+        baldes = [int(b) for b in pedido["baldes"]]
+        if any(not 0 <= b < MERKLE_FOLHAS for b in baldes): raise ValueError(baldes)
+        return {"lww": await crdt.entradas_baldes(baldes)}
+    nos = [int(n) for n in pedido.get("nos", [1])]
+    if any(not 0 < n < 2 * MERKLE_FOLHAS for n in nos): raise ValueError(nos)
+    return {"hashes": await crdt.hashes(nos)}
 
 async def handle_gossip(request: web.Request):
-    data = await request.json()
-    items = _coerce_items(data.get("lww", []))
-    await request.app["crdt"].merge_many(items)
-    request.app["logger"].info(f"[REMOTO] Recebidas {len(items)} entradas de {request.remote}")
-    estado = await request.app["crdt"].snapshot()
-    log_estado(request.app["logger"], estado, "Após merge remoto")
-    return web.json_response({"ok": True})
+    try:
+        # o aiohttp já descomprime Content-Encoding (deflate/gzip) enquanto lê
+        resposta = await receber_gossip(request.app, request.content.iter_chunked(_PEDACO),
+                                        request.content_type,
+                                        request.headers.get("X-Gossip-Origem") or str(request.remote),
+                                        request.content_length)
+    except (ValueError, KeyError, TypeError, struct.error) as e:
+        raise web.HTTPBadRequest(text=f"gossip inválido: {e}", headers=_ACCEPT_POST)
+    return web.json_response(resposta, headers=_ACCEPT_POST)
+
+async def handle_digest(request: web.Request):
+    try:
+        return web.json_response(await responder_digest(request.app, await request.json()))
+    except (TypeError, ValueError) as e:
+        raise web.HTTPBadRequest(text=f"pedido de digest inválido: {e}")
+
+def _entrada_json(ts: int, nid: int, val: float) -> dict:
+    return {"ts": ts, "node_id": nid, "value": val}
+
+def _verificar_etag(request: web.Request, versao: Union[int, str]) -> Dict[str, str]:
+    """ETag da versão lida; 304 sem montar o corpo se o cliente já a tem.
+    `instancia` muda a cada partida, já que as versões recomeçam."""
+    etag = f'"{request.app["instancia"]}-{versao}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    pedidas = request.headers.get("If-None-Match", "")
+    if pedidas.strip() == "*" or etag in (t.strip() for t in pedidas.split(",")):
+        raise web.HTTPNotModified(headers=headers)
+    return headers
+
+async def handle_chave(request: web.Request):
+    crdt: LWWMap = request.app["crdt"]
+    key = request.match_info["chave"]
+    versao = crdt.versao_chave(key)
+    if not versao: raise web.HTTPNotFound(text=f"chave {key} desconhecida")
+    headers = _verificar_etag(request, versao)
+    ts, nid, val = await crdt.obter(key)
+    return web.json_response({"key": key, **_entrada_json(ts, nid, val)}, headers=headers)
+
+async def handle_historico(request: web.Request):
+    """GET /historico/{chave}?minutos=10 -> amostras brutas e médias por janela."""
+    crdt: LWWMap = request.app["crdt"]
+    if crdt.historico is None: raise web.HTTPNotFound(text="histórico desligado (LWW_HISTORICO)")
+    key = request.match_info["chave"]
+    try: minutos = float(request.query.get("minutos", "10"))
+    except ValueError: raise web.HTTPBadRequest(text="minutos inválido")
+    versao = crdt.versao_chave(key)
+    if not versao: raise web.HTTPNotFound(text=f"chave {key} desconhecida")
+    # o corte depende do relógio, então a ETag leva também o minuto da consulta
+    agora_ms = int(time.time() * 1000)
+    headers = _verificar_etag(request, f"{versao}.{minutos:g}.{agora_ms // 60000}")
+    dados = crdt.historico.consultar(key, agora_ms - int(minutos * 60000)) or {"brutos": [], "janelas": {}}
+    return web.json_response({"key": key, **dados}, headers=headers)
+
+def _dispositivos_json(grouped) -> dict:
+    return {d: {met: _entrada_json(*e) for met, e in sorted(metricas.items())}
+            for d, metricas in grouped.items()}
+
+async def handle_dispositivo(request: web.Request):
+    crdt: LWWMap = request.app["crdt"]
+    disp = request.match_info["dispositivo"]
+    versao = crdt.versao_dispositivos([disp])
+    if not versao: raise web.HTTPNotFound(text=f"dispositivo {disp} desconhecido")
+    headers = _verificar_etag(request, versao)
+    grouped = await crdt.agrupar([disp])
+    return web.json_response({"dispositivo": disp, "metricas": _dispositivos_json(grouped)[disp]},
+                             headers=headers)
+
+async def handle_dispositivos(request: web.Request):
+    """GET /dispositivos?prefixo=disp1 -> todos os dispositivos com o prefixo."""
+    crdt: LWWMap = request.app["crdt"]
+    disps = crdt.faixa_dispositivos(request.query.get("prefixo", ""))
+    # a contagem entra na ETag para a faixa mudar também quando um dispositivo sai
+    headers = _verificar_etag(request, f"{crdt.versao_dispositivos(disps)}.{len(disps)}")
+    return web.json_response({"dispositivos": _dispositivos_json(await crdt.agrupar(disps))},
+                             headers=headers)
+
+def _escrita(x: Union[list, dict], agora_ms: int, futuro_max_ms: int) -> Tuple[str, int, float]:
+    """{"key", "value", "ts"?} ou [key, value] / [key, ts, value]; ts padrão = agora.
+    ts além de agora + futuro_max_ms é recusado: venceria toda escrita futura da chave."""
+    if isinstance(x, dict):
+        key, ts, val = x["key"], x.get("ts", agora_ms), x["value"]
+    elif len(x) == 2:
+        (key, val), ts = x, agora_ms
+    else:
+        key, ts, val = x
+    _validar_chave(key)
+    ts = int(ts)
+    if ts > agora_ms + futuro_max_ms: raise ValueError(f"ts {ts} de {key!r} está mais de {futuro_max_ms} ms no futuro")
+    return key, ts, float(val)
+
+async def handle_ingest(request: web.Request):
+    """POST /ingest {"escritas": [...]} -> 202; aplicadas na próxima janela."""
+    app = request.app
+    ingestao: BufferIngestao = app["ingestao"]
+    agora_ms, nid = int(time.time() * 1000), app["porta"]
+    aceitas = 0
+    try:
+        fluxo = Fluxo(request.content.iter_chunked(_PEDACO))
+        async for x in itens_json_fluxo(fluxo, "escritas"):
+            key, ts, val = _escrita(x, agora_ms, app["ingest_futuro_max_ms"])
+            ingestao.adicionar(key, ts, nid, val)
+            aceitas += 1
+            if ingestao.cheio: await ingestao.descarregar()
+    except (ValueError, KeyError, TypeError) as e:
+        # as escritas anteriores ao erro já estão no buffer
+        raise web.HTTPBadRequest(text=f"ingestão inválida após {aceitas} escritas: {e}")
+    return web.json_response({"ok": True, "aceitas": aceitas}, status=202)
+
+async def handle_metrics(request: web.Request):
+    metricas: MetricasNo = request.app["metricas"]
+    crdt: LWWMap = request.app["crdt"]
+    metricas.chaves.definir(len(crdt._state))
+    metricas.versao.definir(crdt.versao)
+    return web.Response(body=metricas.expor().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
 async def handle_health(_request: web.Request):
     return web.Response(text="ok")
 
-async def on_startup(app: web.Application):
-    app["session"] = aiohttp.ClientSession()
-    app["task_local"] = asyncio.create_task(gerar_metricas(app))
+# ------------------ Ciclo de vida ------------------
+def configurar_app(app, porta: int, companheiros: List[str], logger: logging.Logger, env=os.environ):
+    """Preenche `app` (web.Application ou dict, na simulação) com o estado e a
+    configuração do nó, lidos das variáveis de ambiente em `env`."""
+    app["porta"] = porta
+    app["companheiros"] = companheiros
+    app["logger"] = logger
+    shards = int(env.get("LWW_SHARDS", "16"))
+    app["metricas"] = MetricasNo()
+    backend = LWWMapColunar if env.get("LWW_BACKEND") == "colunar" else LWWMap
+    ttl = PoliticaTTL(env["LWW_TTL"]) if env.get("LWW_TTL") else None
+    historico = None
+    if int(env.get("LWW_HISTORICO", "0")) > 0:
+        niveis = [tuple(map(float, n.split(":"))) for n in env.get("LWW_HISTORICO_NIVEIS", "60:60,3600:24").split(",") if n]
+        historico = HistoricoLWW(int(env["LWW_HISTORICO"]), [(passo, int(janelas)) for passo, janelas in niveis])
+    app["crdt"] = backend(shards, app["metricas"], ttl, int(env.get("LWW_MAX_CHAVES", "0")), historico)
+    app["varredura_s"] = float(env.get("LWW_VARREDURA_S", "5"))
+    app["ingestao"] = BufferIngestao(app, float(env.get("INGEST_JANELA_MS", "50")) / 1000,
+                                     int(env.get("INGEST_MAX_PENDENTES", "100000")))
+    app["ingest_futuro_max_ms"] = int(env.get("INGEST_FUTURO_MAX_MS", "60000"))
+    app["epoca"] = uuid.uuid4().hex
+    # ao contrário da época (reaproveitada ao restaurar), muda a cada partida
+    app["instancia"] = uuid.uuid4().hex[:12]
+    if env.get("LWW_DADOS"):
+        app["persistencia"] = Persistencia(env["LWW_DADOS"], app["crdt"], logger,
+                                           float(env.get("WAL_FSYNC_MS", "200")) / 1000,
+                                           float(env.get("SNAPSHOT_S", "60")))
+    app["registro_estado"] = RegistroEstado(logger, app["crdt"], float(env.get("LOG_DUMP_S", "30")))
+    app["agenda"] = AgendaGossip(app["crdt"], float(env.get("GOSSIP_INTERVALO_S", "2")),
+                                 float(env.get("GOSSIP_MIN_S", "0.1")), float(env.get("GOSSIP_MAX_S", "10")),
+                                 int(env.get("GOSSIP_SUJAS_ALVO", "256")))
+    app["local_intervalo_s"] = float(env.get("LOCAL_INTERVALO_S", "0.5"))
+    app["gossip_falhas_full"] = int(env.get("GOSSIP_FALHAS_FULL", "5"))
+    app["gossip_resync_s"] = float(env.get("GOSSIP_RESYNC_S", "60"))
+    app["gossip_formato"] = TIPO_JSON if env.get("GOSSIP_FORMATO", "bin") == "json" else TIPO_BIN
+    app["gossip_compressao"] = env.get("GOSSIP_COMPRESSAO", "1") == "1"
+    app["anti_entropia_s"] = float(env.get("ANTI_ENTROPIA_S", "10"))
+    app["gossip_fanout"] = int(env.get("GOSSIP_FANOUT", "0"))
+    app["gossip_concorrencia"] = int(env.get("GOSSIP_CONCORRENCIA", "8"))
+    app["gossip_backoff_max_s"] = float(env.get("GOSSIP_BACKOFF_MAX_S", "30"))
+    app["gossip_udp"] = env.get("GOSSIP_UDP", "0") == "1"
+    app["gossip_udp_timeout_s"] = float(env.get("GOSSIP_UDP_TIMEOUT_MS", "300")) / 1000
+    app["endereco"] = endereco = env.get("ENDERECO", f"localhost:{porta}")
+    app["anel"] = None
+    app["repasse"] = {}  # chave -> donos, das escritas locais fora da fatia deste nó
+    anel = [n.strip() for n in env.get("ANEL_NOS", "").split(",") if n.strip()]
+    if anel:
+        # modo particionado: os peers passam a ser os demais nós do anel e a
+        # anti-entropia (árvores de Merkle do mapa inteiro) fica desligada,
+        # já que cada nó guarda só a sua parte do espaço de chaves
+        if endereco not in anel: raise ValueError(f"ENDERECO {endereco} fora de ANEL_NOS")
+        app["anel"] = AnelConsistente(anel, int(env.get("REPLICACAO", "2")), int(env.get("ANEL_VNODES", "64")))
+        app["companheiros"] = [n for n in app["anel"].nos if n != endereco]
+        app["anti_entropia_s"] = 0
+    return app
+
+_TAREFAS = ("task_local", "task_gossip", "task_anti_entropia", "task_persistencia", "task_ttl", "task_ingestao")
+
+async def iniciar_tarefas(app):
+    """Restaura o estado durável e inicia gossip, anti-entropia e persistência.
+    Requer app["transporte"]."""
+    app["peers"] = [Companheiro(c) for c in app["companheiros"]]
+    if app.get("persistencia"):
+        # antes de gerar ou aceitar gossip: o nó volta com o último estado durável
+        app["epoca"] = await app["persistencia"].carregar(app["epoca"])
+        _marcar_repasse(app, await app["crdt"].snapshot())
+        app["task_persistencia"] = asyncio.create_task(app["persistencia"].executar())
     app["task_gossip"] = asyncio.create_task(disseminar(app))
-    app["logger"].info(f"[START] Python na porta {app['porta']}")
+    if app["anti_entropia_s"] > 0:
+        app["task_anti_entropia"] = asyncio.create_task(anti_entropia(app))
+    if app["crdt"].ttl is not None:
+        app["task_ttl"] = asyncio.create_task(varrer_expirados(app))
+    app["task_ingestao"] = asyncio.create_task(app["ingestao"].executar())
 
-async def on_cleanup(app: web.Application):
-    for key in ("task_local", "task_gossip"):
+async def parar_tarefas(app):
+    for key in _TAREFAS:
         t = app.get(key)
         if t:
             t.cancel()
             try: await t
             except asyncio.CancelledError: pass
-    if app.get("session"): await app["session"].close()
+    # o que ainda estava na janela de ingestão entra no estado antes do WAL final
+    await app["ingestao"].descarregar()
+    if app.get("persistencia"): await app["persistencia"].encerrar()
+
+async def on_startup(app: web.Application):
+    app["transporte"] = TransporteHttp(app["gossip_concorrencia"])
+    if app["gossip_udp"]:
+        # mesma porta numérica do HTTP; peers Python sem UDP nunca anunciam "udp"
+        _, app["udp"] = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: TransporteUdp(app, app["gossip_udp_timeout_s"]), local_addr=("0.0.0.0", app["porta"]))
+    await iniciar_tarefas(app)
+    app["task_local"] = asyncio.create_task(gerar_metricas(app))
+    app["logger"].info(f"[START] Python na porta {app['porta']}")
+
+async def on_cleanup(app: web.Application):
+    await parar_tarefas(app)
+    if app.get("transporte"): await app["transporte"].fechar()
+    if app.get("udp"): app["udp"].fechar()
 
 if __name__ == "__main__":
     porta = int(os.getenv("PORTA", "5000"))
     companheiros = [p.strip() for p in os.getenv("COMPANHEIROS", "").split(",") if p.strip()]
     logger = configurar_logger(porta)
 
-    app = web.Application()
-    app["porta"] = porta
-    app["companheiros"] = companheiros
-    app["logger"] = logger
-    app["crdt"] = LWWMap()
+    app = configurar_app(web.Application(), porta, companheiros, logger)
 
     app.router.add_post("/gossip", handle_gossip)
+    app.router.add_post("/digest", handle_digest)
+    app.router.add_post("/ingest", handle_ingest)
+    app.router.add_get("/chave/{chave}", handle_chave)
+    app.router.add_get("/dispositivo/{dispositivo}", handle_dispositivo)
+    app.router.add_get("/dispositivos", handle_dispositivos)
+    app.router.add_get("/historico/{chave}", handle_historico)
+    app.router.add_get("/metrics", handle_metrics)
     app.router.add_get("/healthz", handle_health)
     app.on_startup.append(on_startup)
     app.on_cleanup.append(on_cleanup)
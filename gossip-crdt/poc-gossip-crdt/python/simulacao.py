@@ -0,0 +1,200 @@
+"""Simulação de N nós Python no mesmo processo, sem HTTP.
+
+Cada nó é o mesmo estado montado por `configurar_app` e as mesmas tarefas de
+gossip/anti-entropia do servidor; só o transporte é trocado por uma rede em
+memória com latência, perda e partição configuráveis. Mede o tempo até a
+convergência (raízes de Merkle iguais depois que as escritas param), os bytes
+trocados e as entradas mescladas por segundo.
+
+Listas separadas por vírgula em --nos/--chaves/--escritas varrem todas as
+combinações; cada execução imprime uma linha JSON:
+
+    python simulacao.py --nos 3,10,30 --chaves 1000 --escritas 200 --perda 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from servidor import (
+    _ACCEPT_POST, configurar_app, escrever_local, iniciar_tarefas, parar_tarefas,
+    pedacos_corpo, receber_gossip, responder_digest,
+)
+
+class Rede:
+    """Rede em memória compartilhada pelos nós simulados."""
+    def __init__(self, latencia: float, jitter: float, perda: float, rng: random.Random):
+        self.nos: Dict[str, dict] = {}
+        self.latencia, self.jitter, self.perda = latencia, jitter, perda
+        self.rng = rng
+        self.grupos: Optional[Dict[str, int]] = None  # partição ativa: endereço -> lado
+
+    def particionar(self):
+        """Divide os nós em duas metades que não se enxergam."""
+        enderecos = list(self.nos)
+        self.grupos = {e: i * 2 // len(enderecos) for i, e in enumerate(enderecos)}
+
+    def curar(self):
+        self.grupos = None
+
+    async def entregar(self, origem: str, destino: str) -> dict:
+        await asyncio.sleep(self.latencia + self.rng.uniform(0, self.jitter))
+        if self.grupos and self.grupos[origem] != self.grupos[destino]:
+            raise ConnectionError(f"partição entre {origem} e {destino}")
+        if self.rng.random() < self.perda:
+            raise ConnectionError(f"perda de pacote {origem} -> {destino}")
+        return self.nos[destino]
+
+class TransporteMemoria:
+    """Mesma interface de TransporteHttp, entregando direto ao nó de destino."""
+    def __init__(self, rede: Rede, origem: str):
+        self.rede, self.origem = rede, origem
+
+    async def gossip(self, endereco: str, corpo: bytes, headers: Dict[str, str]) -> Tuple[Dict[str, str], Optional[dict]]:
+        app = await self.rede.entregar(self.origem, endereco)
+        pedacos = pedacos_corpo(corpo, headers.get("Content-Encoding") == "deflate")
+        dados = await receber_gossip(app, pedacos, headers["Content-Type"], self.origem, len(corpo))
+        return dict(_ACCEPT_POST), dados
+
+    async def digest(self, endereco: str, pedido: dict) -> dict:
+        app = await self.rede.entregar(self.origem, endereco)
+        return await responder_digest(app, pedido)
+
+    async def fechar(self):
+        pass
+
+async def escritor(app: dict, chaves: int, escritas_s: float, rng: random.Random):
+    """Grava `escritas_s` entradas/s em chaves sorteadas entre `chaves`
+    (compartilhadas por todos os nós, então há conflitos de LWW)."""
+    passo = 0.05
+    por_passo = escritas_s * passo
+    acumulado = 0.0
+    while True:
+        acumulado += por_passo
+        n, acumulado = int(acumulado), acumulado - int(acumulado)
+        if n:
+            ts = int(time.time() * 1000)
+            lote = [(f"disp{rng.randrange(chaves)}:temperatura", ts, app["porta"],
+                     float(rng.randint(0, 100))) for _ in range(n)]
+            await escrever_local(app, lote)
+        await asyncio.sleep(passo)
+
+async def _convergido(apps: List[dict]) -> bool:
+    anel = apps[0]["anel"]
+    if anel is None:
+        raizes = {tuple(await app["crdt"].hashes([1])) for app in apps}
+        return len(raizes) == 1
+    # particionado: toda chave existente está igual em todas as suas réplicas
+    estados = {app["endereco"]: await app["crdt"].snapshot() for app in apps}
+    chaves = set().union(*estados.values())
+    return all(len({estados[d].get(k) for d in anel.donos(k)}) == 1 for k in chaves)
+
+async def simular(nos: int, chaves: int, escritas: float, args) -> dict:
+    rng = random.Random(args.seed)
+    random.seed(args.seed)  # fanout e jitter de backoff usam o random global
+    rede = Rede(args.latencia_ms / 1000, args.jitter_ms / 1000, args.perda, rng)
+    env = {
+        "LWW_BACKEND": args.backend,
+        "GOSSIP_INTERVALO_S": str(args.intervalo),
+        "GOSSIP_MIN_S": str(args.gossip_min),
+        "GOSSIP_MAX_S": str(args.gossip_max),
+        "GOSSIP_FANOUT": str(args.fanout),
+        "GOSSIP_FORMATO": args.formato,
+        "ANTI_ENTROPIA_S": str(args.anti_entropia),
+        "GOSSIP_BACKOFF_MAX_S": str(args.backoff_max),
+    }
+    enderecos = [f"no{i}" for i in range(nos)]
+    if args.replicacao:
+        env.update(ANEL_NOS=",".join(enderecos), REPLICACAO=str(args.replicacao))
+    apps = []
+    for i, endereco in enumerate(enderecos):
+        logger = logging.getLogger(f"simulacao.{endereco}")
+        logger.setLevel(logging.WARNING)
+        app = configurar_app({}, i, [e for e in enderecos if e != endereco], logger,
+                             dict(env, ENDERECO=endereco))
+        app["transporte"] = TransporteMemoria(rede, endereco)
+        rede.nos[endereco] = app
+        apps.append(app)
+    for app in apps:
+        await iniciar_tarefas(app)
+
+    t0 = time.perf_counter()
+    escritores = [asyncio.create_task(escritor(app, chaves, escritas, random.Random(rng.random())))
+                  for app in apps]
+    try:
+        if args.particao:
+            ini, fim = args.particao
+            await asyncio.sleep(ini)
+            rede.particionar()
+            await asyncio.sleep(max(0.0, fim - ini))
+            rede.curar()
+        await asyncio.sleep(max(0.0, args.duracao - (time.perf_counter() - t0)))
+    finally:
+        for t in escritores: t.cancel()
+        await asyncio.gather(*escritores, return_exceptions=True)
+
+    parada = time.perf_counter()
+    convergencia = None
+    while time.perf_counter() - parada < args.timeout:
+        if await _convergido(apps):
+            convergencia = time.perf_counter() - parada
+            break
+        await asyncio.sleep(0.01)
+    total = time.perf_counter() - t0
+    for app in apps:
+        await parar_tarefas(app)
+
+    metricas = [app["metricas"] for app in apps]
+    mescladas = sum(m.recebido_entradas.total() for m in metricas)
+    return {
+        "nos": nos, "chaves": chaves, "escritas_s": escritas,
+        "fanout": args.fanout, "gossip_min": args.gossip_min, "gossip_max": args.gossip_max, "latencia_ms": args.latencia_ms, "perda": args.perda,
+        "particao": args.particao, "backend": args.backend, "formato": args.formato,
+        "replicacao": args.replicacao or None,
+        "convergencia_s": None if convergencia is None else round(convergencia, 4),
+        "bytes_enviados": int(sum(m.enviado_bytes.total() for m in metricas)),
+        "entradas_enviadas": int(sum(m.enviado_entradas.total() for m in metricas)),
+        "falhas": int(sum(m.falhas.total() for m in metricas)),
+        "merges_s": round(mescladas / total, 1),
+        "chaves_por_no": round(sum([len(await app["crdt"].snapshot()) for app in apps]) / nos, 1),
+    }
+
+def _lista(tipo):
+    return lambda texto: [tipo(x) for x in texto.split(",") if x.strip()]
+
+def _intervalo(texto: str) -> Tuple[float, float]:
+    ini, fim = texto.split(":")
+    return float(ini), float(fim)
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulação de gossip LWW-Map com N nós em memória.")
+    ap.add_argument("--nos", type=_lista(int), default=[5], help="nós (lista separada por vírgula)")
+    ap.add_argument("--chaves", type=_lista(int), default=[100], help="tamanho do espaço de chaves")
+    ap.add_argument("--escritas", type=_lista(float), default=[50.0], help="escritas/s por nó")
+    ap.add_argument("--duracao", type=float, default=5.0, help="segundos de escrita")
+    ap.add_argument("--timeout", type=float, default=30.0, help="espera máxima pela convergência")
+    ap.add_argument("--fanout", type=int, default=0)
+    ap.add_argument("--intervalo", type=float, default=0.2, help="intervalo base entre rodadas de gossip (s)")
+    ap.add_argument("--gossip-min", type=float, default=0.02)
+    ap.add_argument("--gossip-max", type=float, default=2.0)
+    ap.add_argument("--anti-entropia", type=float, default=1.0, help="período da anti-entropia (s, 0 desliga)")
+    ap.add_argument("--backoff-max", type=float, default=2.0)
+    ap.add_argument("--latencia-ms", type=float, default=2.0)
+    ap.add_argument("--jitter-ms", type=float, default=1.0)
+    ap.add_argument("--perda", type=float, default=0.0, help="probabilidade de perda por mensagem")
+    ap.add_argument("--particao", type=_intervalo, default=None, help="INI:FIM em segundos")
+    ap.add_argument("--backend", choices=("dict", "colunar"), default="dict")
+    ap.add_argument("--formato", choices=("bin", "json"), default="bin")
+    ap.add_argument("--replicacao", type=int, default=0, help="réplicas por chave no modo particionado (0 = todos)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    for nos, chaves, escritas in itertools.product(args.nos, args.chaves, args.escritas):
+        print(json.dumps(asyncio.run(simular(nos, chaves, escritas, args))), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Testes do servidor Python: python -m pytest -q (na pasta python/)."""
+import asyncio
+import json
+import logging
+
+import pytest
+
+import servidor as S
+
+def _no(endereco: str, env=None) -> dict:
+    """Nó montado como na simulação: configurar_app sobre um dict, sem HTTP."""
+    app = S.configurar_app({}, 1, [], logging.getLogger(f"teste.{endereco}"), dict(env or {}, ENDERECO=endereco))
+    app["epoca"] = f"epoca-{endereco}"
+    return app
+
+class _TransporteDireto:
+    """Entrega o corpo do gossip direto em receber_gossip do nó de destino."""
+    def __init__(self, nos: dict, origem: str):
+        self.nos, self.origem = nos, origem
+
+    async def gossip(self, endereco, corpo, headers):
+        pedacos = S.pedacos_corpo(corpo, headers.get("Content-Encoding") == "deflate")
+        dados = await S.receber_gossip(self.nos[endereco], pedacos, headers["Content-Type"], self.origem)
+        return dict(S._ACCEPT_POST), dados
+
+@pytest.mark.parametrize("chave", ["a\nb", "\ud800"])
+def test_chave_nao_representavel_nao_envenena_o_gossip_binario(chave):
+    async def cenario():
+        a, b = _no("a:1"), _no("b:2")
+        a["transporte"] = _TransporteDireto({"b:2": b}, "a:1")
+        # um peer JSON (Go/Rust) manda uma chave que o formato binário não representa
+        corpo = json.dumps({"lww": [["d1:t", 5, 9, 1.0], [chave, 5, 9, 2.0]]}).encode()
+        with pytest.raises(ValueError):
+            await S.receber_gossip(a, S.pedacos_corpo(corpo), S.TIPO_JSON, "go:1")
+        assert await a["crdt"].obter(chave) is None  # o corpo inteiro é recusado (400)
+        await S.receber_gossip(a, S.pedacos_corpo(json.dumps({"lww": [["d1:t", 5, 9, 1.0]]}).encode()), S.TIPO_JSON, "go:1")
+        # e o envio binário para os demais peers continua funcionando
+        comp = S.Companheiro("b:2")
+        comp.formato = S.TIPO_BIN
+        await S._enviar_gossip(a, comp)
+        assert comp.falhas == 0 and comp.ack == a["crdt"].versao
+        assert await b["crdt"].obter("d1:t") == (5, 9, 1.0)
+    asyncio.run(cenario())
+
+def test_persistencia_sobrevive_a_falha_de_disco(tmp_path):
+    async def cenario():
+        a = _no("a:1", {"LWW_DADOS": str(tmp_path), "WAL_FSYNC_MS": "1"})
+        p = a["persistencia"]
+        await p.carregar(a["epoca"])
+        anexar, falhas = p._anexar_wal, []
+        def disco_cheio(dados):
+            if not falhas:
+                falhas.append(dados)
+                raise OSError(28, "No space left on device")
+            anexar(dados)
+        p._anexar_wal = disco_cheio
+        # chave que o formato binário não representa, vinda de antes da validação
+        await a["crdt"].merge_many([("d1:t", 5, 9, 1.0), ("a\nb", 5, 9, 2.0)], remoto=False)
+        tarefa = asyncio.create_task(p.executar())
+        for _ in range(200):
+            await asyncio.sleep(0.005)
+            if p._versao == a["crdt"].versao: break
+        assert falhas and not tarefa.done()
+        tarefa.cancel()
+        b = _no("a:1", {"LWW_DADOS": str(tmp_path)})
+        await b["persistencia"].carregar(b["epoca"])
+        assert await b["crdt"].delta_desde(0) == ([("d1:t", 5, 9, 1.0)], 1)
+    asyncio.run(cenario())
+
+def test_epoca_muda_apos_encerramento_nao_limpo(tmp_path):
+    async def reiniciar(epoca):
+        a = _no("a:1", {"LWW_DADOS": str(tmp_path)})
+        return a, await a["persistencia"].carregar(epoca)
+    async def cenario():
+        a, epoca = await reiniciar("e1")
+        await a["crdt"].merge_many([("d1:t", 5, 9, 1.0)], remoto=False)
+        await a["persistencia"].encerrar()
+        # encerramento limpo: os peers podem continuar do último ack
+        a, epoca = await reiniciar("e2")
+        assert epoca == "e1" and await a["crdt"].obter("d1:t") == (5, 9, 1.0)
+        await a["persistencia"].gravar_wal()
+        # queda: o nó volta com época nova e recebe dos peers o estado completo
+        a, epoca = await reiniciar("e3")
+        assert epoca == "e3" and await a["crdt"].obter("d1:t") == (5, 9, 1.0)
+    asyncio.run(cenario())
+
+class _TransporteRegistro:
+    def __init__(self):
+        self.enviados = []
+
+    async def gossip(self, endereco, corpo, headers):
+        self.enviados.append((endereco, json.loads(corpo)["lww"]))
+        return dict(S._ACCEPT_POST), {"ok": True, "epoca": f"epoca-{endereco}"}
+
+def test_entradas_recebidas_nao_voltam_para_a_origem():
+    async def cenario():
+        a = _no("a:1")
+        a["transporte"] = t = _TransporteRegistro()
+        a["peers"] = b, c = [S.Companheiro("b:2"), S.Companheiro("c:3")]
+        for comp in (b, c):
+            comp.ack, comp.epoca = 0, f"epoca-{comp.endereco}"
+        corpo = json.dumps({"lww": [["d1:t", 5, 9, 1.0], ["d2:t", 5, 9, 2.0]]}).encode()
+        await S.receber_gossip(a, S.pedacos_corpo(corpo), S.TIPO_JSON, "b:2")
+        await S.escrever_local(a, [("d2:t", 6, 1, 3.0)])
+        for comp in (b, c): await S._enviar_gossip(a, comp)
+        assert sorted(t.enviados) == [("b:2", [["d2:t", 6, 1, 3.0]]),
+                                      ("c:3", [["d2:t", 6, 1, 3.0], ["d1:t", 5, 9, 1.0]])]
+        assert b.ack == a["crdt"].versao and not b.ecos
+    asyncio.run(cenario())
+
+@pytest.mark.parametrize("pedido", [[], 1, "nos", None])
+def test_digest_recusa_pedido_que_nao_e_objeto(pedido):
+    with pytest.raises(ValueError):
+        asyncio.run(S.responder_digest(_no("a:1"), pedido))
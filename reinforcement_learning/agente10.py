@@ -1,23 +1,28 @@
 # Versão final: aprendizado de "hit-and-run" (atira e foge) + busca de vida e munição.
 # Uso:
-#   pip install pygame
+#   pip install numpy pygame
 #   python agente10.py --treinar --episodios 30000
 #   python agente10.py --demo
-# Arquivo salva política em qtable_final.pkl após treinar.
+# Arquivo salva política em qtable_final.bin após treinar (--resume retoma do checkpoint).
 
-import os, random, pickle, argparse
-from collections import defaultdict, deque, Counter
-from typing import Dict, Tuple, Optional
+import os, mmap, multiprocessing, queue, random, pickle, struct, argparse
+from collections import deque, Counter
+from operator import mul
+from typing import Tuple, Optional
+
+import numpy as np
 
 # -------------------------
 # Ambiente (grid simples)
 # -------------------------
 class JogoAcaoEnv:
-    def __init__(self, tamanho=10, max_passos=360, semente: Optional[int]=None):
+    def __init__(self, tamanho=10, max_passos=360, semente: Optional[int]=None, rng=None):
         self.N = tamanho
         self.max_passos = max_passos
+        # rng: um random.Random próprio (treino paralelo) ou o módulo random global
+        self.rng = rng if rng is not None else random
         if semente is not None:
-            random.seed(semente)
+            self.rng.seed(semente)
 
         # parâmetros de jogo
         self.custo_passo = -0.004
@@ -57,6 +62,8 @@ class JogoAcaoEnv:
 
         # ações: 0..3 mover; 4 atirar; 5 ficar; 6 sprint (2 passos fugindo)
         self.acoes = 7
+        # nº de valores de cada campo de _estado(), para a codificação em base mista
+        self.dims_estado = (self.N, self.N, self.N, self.N, 2, 11, 11, 10)
 
     def _reset_mapa_estatico(self):
         # cria uma "parede" vertical quebrada no meio (linha de cobertura)
@@ -66,6 +73,47 @@ class JogoAcaoEnv:
             if r % 2 == 0:
                 self.paredes_base.add((r, col))
 
+    # paredes é um frozenset: trocar o mapa é sempre uma atribuição, que refaz
+    # as tabelas de geometria quando o conjunto muda de fato (o reset reatribui
+    # o mesmo mapa a cada episódio, sem custo)
+    @property
+    def paredes(self):
+        return self._paredes
+
+    @paredes.setter
+    def paredes(self, valor):
+        valor = frozenset(valor)
+        if valor != getattr(self, "_paredes", None):
+            self._paredes = valor
+            self._montar_tabelas()
+
+    def _montar_tabelas(self):
+        # geometria estática por célula, indexada [x][y]: destino de cada
+        # movimento (sem considerar o outro personagem), adjacência a parede,
+        # canto e, por célula, o conjunto de células com visada livre
+        N, paredes = self.N, self._paredes
+        def livre(x, y): return 0 <= x < N and 0 <= y < N and (x, y) not in paredes
+        self._tab_mov = [[tuple((x+dx, y+dy) if livre(x+dx, y+dy) else (x, y)
+                                for dx, dy in ((-1,0),(1,0),(0,-1),(0,1)))
+                          for y in range(N)] for x in range(N)]
+        self._tab_adj = [[any(v in paredes for v in ((x, y-1), (x, y+1), (x-1, y), (x+1, y)))
+                          for y in range(N)] for x in range(N)]
+        self._tab_canto = [[1 - min(x, y, N-1-x, N-1-y) for y in range(N)] for x in range(N)]
+        self._tab_visada = [[set() for y in range(N)] for x in range(N)]
+        for x in range(N):
+            for y in range(N):
+                vis = self._tab_visada[x][y]
+                vis.add((x, y))
+                for dx, dy in ((-1,0),(1,0),(0,-1),(0,1)):
+                    # a visada atravessa até a primeira parede (que também é visível)
+                    bx, by = x + dx, y + dy
+                    while 0 <= bx < N and 0 <= by < N:
+                        vis.add((bx, by))
+                        if (bx, by) in paredes: break
+                        bx, by = bx + dx, by + dy
+        # destinos do sprint por (x, y, alvo, bloqueado), preenchidos sob demanda
+        self._tab_sprint = {}
+
     def reset(self):
         self.passos = 0
         self.vida = 100
@@ -107,13 +155,20 @@ class JogoAcaoEnv:
         return True
 
     def _mover(self, x, y, acao, bloqueado: Optional[Tuple[int,int]]=None):
-        dxdy = {0:(-1,0),1:(1,0),2:(0,-1),3:(0,1)}
-        dx, dy = dxdy.get(acao, (0,0))
-        nx, ny = x + dx, y + dy
-        return (nx, ny) if self._livre(nx, ny, bloqueado=bloqueado) else (x, y)
+        if not 0 <= acao < 4: return (x, y)
+        destino = self._tab_mov[x][y][acao]
+        return (x, y) if destino == bloqueado else destino
 
     def _mover_duplo_melhorando_dist(self, x, y, alvox, alvoy, bloqueado=None):
-        # tenta duas moves que maximizam distância ao alvo (usado pelo sprint)
+        # tenta duas moves que maximizam distância ao alvo (usado pelo sprint);
+        # a lista de empatados fica em cache, o sorteio continua a cada chamada
+        chave = (x, y, alvox, alvoy, bloqueado)
+        melhores = self._tab_sprint.get(chave)
+        if melhores is None:
+            melhores = self._tab_sprint[chave] = self._melhores_sprint(x, y, alvox, alvoy, bloqueado)
+        return self.rng.choice(melhores) if melhores else (x,y)
+
+    def _melhores_sprint(self, x, y, alvox, alvoy, bloqueado):
         melhores = []
         melhor_gain = -10**9
         d0 = abs(x - alvox) + abs(y - alvoy)
@@ -127,40 +182,27 @@ class JogoAcaoEnv:
                         melhor_gain = gain; melhores = [(x2,y2)]
                     elif gain == melhor_gain:
                         melhores.append((x2,y2))
-        return random.choice(melhores) if melhores else (x,y)
+        return melhores
 
     # linha de visada (linha reta sem paredes)
     def _linha_visada_livre(self, ax, ay, bx, by):
-        if ax == bx:
-            step = 1 if by > ay else -1
-            for y in range(ay+step, by, step):
-                if (ax,y) in self.paredes: return False
-            return True
-        if ay == by:
-            step = 1 if bx > ax else -1
-            for x in range(ax+step, bx, step):
-                if (x,ay) in self.paredes: return False
-            return True
-        return False
+        return (bx, by) in self._tab_visada[ax][ay]
 
     def _inimigo_tem_visada(self): return self._linha_visada_livre(self.ini_x, self.ini_y, self.jog_x, self.jog_y)
     def _jogador_tem_visada(self): return self._linha_visada_livre(self.jog_x, self.jog_y, self.ini_x, self.ini_y)
 
     def _adjacente_a_parede(self):
-        viz = [(self.jog_x, self.jog_y-1),(self.jog_x, self.jog_y+1),
-               (self.jog_x-1, self.jog_y),(self.jog_x+1, self.jog_y)]
-        return any(v in self.paredes for v in viz)
+        return self._tab_adj[self.jog_x][self.jog_y]
 
     def _atualizar_cobertura(self):
         self.em_cobertura = self._adjacente_a_parede() and (not self._inimigo_tem_visada())
 
     def _corner_score(self, x, y):
-        di = min(x, y, self.N-1-x, self.N-1-y)
-        return (1 - di)  # 1 em canto, 0 no interior
+        return self._tab_canto[x][y]  # 1 - distância à borda: 1 em canto, 0 no interior
 
     def _passo_inimigo(self):
         move_feito = False
-        if random.random() < self.prob_mov_inimigo:
+        if self.rng.random() < self.prob_mov_inimigo:
             candidatos = []
             melhor_d = 10**9
             for ac in (0,1,2,3):
@@ -172,11 +214,11 @@ class JogoAcaoEnv:
                     elif d == melhor_d:
                         candidatos.append((nx,ny))
             if candidatos:
-                self.ini_x, self.ini_y = random.choice(candidatos)
+                self.ini_x, self.ini_y = self.rng.choice(candidatos)
                 move_feito = True
-        if (not move_feito) and random.random() < self.prob_mov_aleatorio_inimigo:
+        if (not move_feito) and self.rng.random() < self.prob_mov_aleatorio_inimigo:
             for _ in range(4):
-                ac = random.choice((0,1,2,3))
+                ac = self.rng.choice((0,1,2,3))
                 nx,ny = self._mover(self.ini_x, self.ini_y, ac, bloqueado=(self.jog_x, self.jog_y))
                 if (nx,ny) != (self.ini_x, self.ini_y):
                     self.ini_x, self.ini_y = nx,ny
@@ -240,7 +282,7 @@ class JogoAcaoEnv:
         # --- ação do inimigo ---
         if not fim:
             if self._inimigo_tem_visada() and self.cd_inimigo == 0:
-                if random.random() < self.prob_tiro_inimigo:
+                if self.rng.random() < self.prob_tiro_inimigo:
                     dano = self.dano_inimigo
                     if self.em_cobertura:
                         dano = int(dano * self.reducao_cobertura)
@@ -329,67 +371,473 @@ class JogoAcaoEnv:
         if self.passos >= self.max_passos: fim = True
         return self._estado(), recompensa, fim, {}
 
+# -------------------------
+# Ambiente em lote (NumPy)
+# -------------------------
+class JogoAcaoEnvLote:
+    # n_jogos partidas com as mesmas regras e shaping de JogoAcaoEnv.step,
+    # cada campo num array NumPy (uma posição por partida) e todas avançando
+    # juntas. Células são indexadas por x*N + y; visada, movimentos, adjacência
+    # a parede e cantos vêm de tabelas montadas uma vez sobre o mapa estático.
+    # O sorteio usa um np.random.Generator próprio, então a sequência não é a
+    # mesma do ambiente escalar, só a distribuição.
+    _PARAMETROS = ("custo_passo", "dano_inimigo", "dano_jogador", "cura_kit", "municao_caixa",
+                   "reducao_cobertura", "cooldown_tiro_inimigo", "cooldown_tiro_jogador",
+                   "prob_tiro_inimigo", "prob_mov_inimigo", "prob_mov_aleatorio_inimigo",
+                   "acoes", "dims_estado")
+
+    def __init__(self, n_jogos=1024, tamanho=10, max_passos=360, semente: Optional[int]=None):
+        ref = JogoAcaoEnv(tamanho=tamanho, max_passos=max_passos)
+        for nome in self._PARAMETROS:
+            setattr(self, nome, getattr(ref, nome))
+        self.N, self.max_passos, self.n_jogos = tamanho, max_passos, n_jogos
+        self.rng = np.random.default_rng(semente)
+        self._montar_tabelas(ref.paredes_base)
+
+        B, N = n_jogos, self.N
+        self.passos = np.zeros(B, np.int64)
+        self.vida = np.zeros(B, np.int64)
+        self.vida_inimigo = np.zeros(B, np.int64)
+        self.municao = np.zeros(B, np.int64)
+        self.em_cobertura = np.zeros(B, bool)
+        self.cd_inimigo = np.zeros(B, np.int64)
+        self.cd_jogador = np.zeros(B, np.int64)
+        self.jog = np.zeros(B, np.int64)   # célula do jogador
+        self.ini = np.zeros(B, np.int64)   # célula do inimigo
+        self.tem_kit = np.zeros(B, bool)
+        self.tem_caixa = np.zeros(B, bool)
+        # memórias para shaping: últimas 3 posições (hist_pos[-1..-3]) e visitas
+        self.hist = np.zeros((B, 3), np.int64)
+        self.visitas = np.zeros((B, N*N), np.int32)
+        self.last_shot_tick = np.zeros(B, np.int64)
+        self.last_enemy_shot_tick = np.zeros(B, np.int64)
+        self.exposure_streak = np.zeros(B, np.int64)
+        self.reset()
+
+    def _montar_tabelas(self, paredes):
+        N = self.N
+        C = N*N
+        cx, cy = np.divmod(np.arange(C), N)
+        self.cx, self.cy = cx, cy
+        parede = np.zeros((N, N), bool)
+        for (x, y) in paredes: parede[x, y] = True
+        # mov[c, a]: destino de cada ação de movimento (a própria célula se bloqueada)
+        self.mov = np.empty((C, 4), np.int64)
+        for a, (dx, dy) in enumerate(((-1,0), (1,0), (0,-1), (0,1))):
+            nx, ny = cx + dx, cy + dy
+            ok = (0 <= nx) & (nx < N) & (0 <= ny) & (ny < N)
+            ok[ok] = ~parede[nx[ok], ny[ok]]
+            self.mov[:, a] = np.where(ok, nx*N + ny, np.arange(C))
+        # visada[c1, c2]: mesma linha/coluna e nenhuma parede estritamente entre elas
+        linha = np.concatenate([np.zeros((N, 1), np.int64), np.cumsum(parede, 1)], 1)
+        coluna = np.concatenate([np.zeros((1, N), np.int64), np.cumsum(parede, 0)], 0)
+        ax, ay, bx, by = cx[:, None], cy[:, None], cx[None, :], cy[None, :]
+        lo_y, hi_y = np.minimum(ay, by) + 1, np.maximum(ay, by)
+        lo_x, hi_x = np.minimum(ax, bx) + 1, np.maximum(ax, bx)
+        entre_y = linha[ax, np.maximum(hi_y, lo_y)] - linha[ax, lo_y]
+        entre_x = coluna[np.maximum(hi_x, lo_x), ay] - coluna[lo_x, ay]
+        self.visada = ((ax == bx) & (entre_y == 0)) | ((ay == by) & (ax != bx) & (entre_x == 0))
+        self.dist = np.abs(ax - bx) + np.abs(ay - by)
+        viz = np.pad(parede, 1)
+        self.adj_parede = (viz[:-2, 1:-1] | viz[2:, 1:-1] | viz[1:-1, :-2] | viz[1:-1, 2:]).ravel()
+        self.canto = 1 - np.minimum(np.minimum(cx, cy), np.minimum(N-1-cx, N-1-cy))
+        self.kit_vida = (N-2)*N + 1
+        self.caixa_municao = 1*N + (N-2)
+
+    def reset(self, mascara=None):
+        m = slice(None) if mascara is None else mascara
+        N = self.N
+        self.passos[m] = 0
+        self.vida[m] = 100
+        self.vida_inimigo[m] = 100
+        self.municao[m] = 6
+        self.cd_inimigo[m] = 0
+        self.cd_jogador[m] = 0
+        self.jog[m] = 1*N + 1
+        self.ini[m] = (N-2)*N + (N-2)
+        self.tem_kit[m] = True
+        self.tem_caixa[m] = True
+        self.hist[m] = 1*N + 1
+        self.visitas[m] = 0
+        self.visitas[m, 1*N + 1] = 1
+        self.last_shot_tick[m] = -999
+        self.last_enemy_shot_tick[m] = -999
+        self.exposure_streak[m] = 0
+        self.em_cobertura[m] = self.adj_parede[self.jog[m]] & ~self.visada[self.ini[m], self.jog[m]]
+        return self._estado()
+
+    def _estado(self):
+        return np.stack([
+            self.cx[self.jog], self.cy[self.jog],
+            self.cx[self.ini], self.cy[self.ini],
+            self.em_cobertura.astype(np.int64),
+            np.minimum(self.vida//10, 10),
+            np.minimum(self.vida_inimigo//10, 10),
+            np.minimum(self.municao, 9),
+        ], 1)
+
+    def _mover(self, c, a, bloqueado):
+        d = self.mov[c, a]
+        return np.where(d == bloqueado, c, d)
+
+    def _sprint(self, c, alvo):
+        # os 16 pares de movimentos do sprint; sorteia entre os de maior ganho
+        # de distância que saem do lugar (pares repetidos pesam como no escalar)
+        a1 = np.repeat(np.arange(4), 4); a2 = np.tile(np.arange(4), 4)
+        c1 = self._mover(c[:, None], a1[None, :], alvo[:, None])
+        c2 = self._mover(c1, a2[None, :], alvo[:, None])
+        ganho = self.dist[c2, alvo[:, None]]
+        valido = c2 != c[:, None]
+        ganho = np.where(valido, ganho, -1)
+        melhor = valido & (ganho == ganho.max(1, keepdims=True))
+        sorteio = np.where(melhor, self.rng.random(melhor.shape), -1.0)
+        destino = c2[np.arange(len(c)), sorteio.argmax(1)]
+        return np.where(valido.any(1), destino, c)
+
+    def _passo_inimigo(self, m):
+        ini, jog = self.ini[m], self.jog[m]
+        n = len(ini)
+        # aproxima: entre os vizinhos livres, sorteia um dos mais próximos do jogador
+        cand = self._mover(ini[:, None], np.arange(4)[None, :], jog[:, None])
+        mudou = cand != ini[:, None]
+        d = np.where(mudou, self.dist[cand, jog[:, None]], 10**9)
+        melhor = mudou & (d == d.min(1, keepdims=True))
+        sorteio = np.where(melhor, self.rng.random((n, 4)), -1.0)
+        aproximar = (self.rng.random(n) < self.prob_mov_inimigo) & mudou.any(1)
+        novo = np.where(aproximar, cand[np.arange(n), sorteio.argmax(1)], ini)
+        # senão, com prob_mov_aleatorio, a primeira de 4 direções sorteadas que sai do lugar
+        dirs = self.rng.integers(0, 4, (n, 4))
+        alt = self._mover(ini[:, None], dirs, jog[:, None])
+        saiu = alt != ini[:, None]
+        aleatorio = (~aproximar) & (self.rng.random(n) < self.prob_mov_aleatorio_inimigo) & saiu.any(1)
+        novo = np.where(aleatorio, alt[np.arange(n), saiu.argmax(1)], novo)
+        self.ini[m] = novo
+
+    def step(self, acoes):
+        """Avança todas as partidas. Devolve (estados, recompensas, fins, info);
+        as partidas que terminaram já voltam reiniciadas em `estados`, com o
+        estado final em info["estado_final"] e as vitórias em info["matou"]."""
+        acoes = np.asarray(acoes)
+        B = self.n_jogos
+        self.passos += 1
+        recompensa = np.zeros(B)
+        fim = np.zeros(B, bool)
+
+        np.maximum(self.cd_inimigo - 1, 0, out=self.cd_inimigo)
+        np.maximum(self.cd_jogador - 1, 0, out=self.cd_jogador)
+
+        dist_prev = self.dist[self.ini, self.jog]
+        corner_prev = self.canto[self.jog]
+        alinhado_prev = (self.cx[self.jog] == self.cx[self.ini]) | (self.cy[self.jog] == self.cy[self.ini])
+        dkv_prev = self.dist[self.jog, self.kit_vida]
+        dmn_prev = self.dist[self.jog, self.caixa_municao]
+
+        # --- ações do jogador ---
+        mover = acoes < 4
+        self.jog = np.where(mover, self._mover(self.jog, np.minimum(acoes, 3), self.ini), self.jog)
+        atirar = acoes == 4
+        disparo = atirar & (self.cd_jogador == 0) & (self.municao > 0) & self.visada[self.jog, self.ini]
+        self.cd_jogador[disparo] = self.cooldown_tiro_jogador
+        self.municao[disparo] -= 1
+        dano = np.minimum(self.vida_inimigo, self.dano_jogador) * disparo
+        self.vida_inimigo -= dano
+        acertou = dano > 0
+        recompensa += np.where(acertou, 0.65 + 0.14*dano, 0.0)
+        self.last_shot_tick[acertou] = self.passos[acertou]
+        matou = disparo & (self.vida_inimigo == 0)
+        recompensa[matou] += 16.0
+        fim |= matou
+        recompensa[atirar & ~disparo] -= 0.015
+        recompensa[acoes == 5] -= 0.04
+        sprint = acoes == 6
+        if sprint.any():
+            self.jog[sprint] = self._sprint(self.jog[sprint], self.ini[sprint])
+            recompensa[sprint] += 0.02
+
+        # coletar itens
+        kit = self.tem_kit & (self.jog == self.kit_vida)
+        self.vida[kit] = np.minimum(100, self.vida[kit] + self.cura_kit); self.tem_kit[kit] = False; recompensa[kit] += 1.0
+        caixa = self.tem_caixa & (self.jog == self.caixa_municao)
+        self.municao[caixa] += self.municao_caixa; self.tem_caixa[caixa] = False; recompensa[caixa] += 0.7
+
+        # atualizar cobertura
+        self.em_cobertura = self.adj_parede[self.jog] & ~self.visada[self.ini, self.jog]
+
+        # --- ação do inimigo ---
+        pode_atirar = ~fim & self.visada[self.ini, self.jog] & (self.cd_inimigo == 0)
+        tiro = pode_atirar & (self.rng.random(B) < self.prob_tiro_inimigo)
+        dano = np.where(self.em_cobertura, int(self.dano_inimigo * self.reducao_cobertura), self.dano_inimigo) * tiro
+        self.vida = np.maximum(0, self.vida - dano)
+        self.cd_inimigo[tiro] = self.cooldown_tiro_inimigo
+        self.last_enemy_shot_tick[tiro] = self.passos[tiro]
+        morreu = tiro & (self.vida == 0)
+        recompensa[morreu] -= 16.0
+        fim |= morreu
+        anda = ~fim & ~tiro
+        if anda.any():
+            self._passo_inimigo(anda)
+
+        # custo por passo
+        recompensa += self.custo_passo
+
+        # shaping (mesmos termos (1)-(7) de JogoAcaoEnv.step)
+        visada = self.visada[self.ini, self.jog]
+        exposto = visada & ~self.em_cobertura
+        self.exposure_streak = np.where(exposto, self.exposure_streak + 1, 0)
+        recompensa -= 0.04 * np.minimum(self.exposure_streak, 6)
+
+        dt = self.passos - self.last_shot_tick
+        pos_tiro = (dt == 1) | (dt == 2)
+        dist_now = self.dist[self.ini, self.jog]
+        recompensa += pos_tiro * (0.65*~visada + 0.15*(dist_now > dist_prev) + 0.19*self.em_cobertura)
+
+        dte = self.passos - self.last_enemy_shot_tick
+        recompensa += 0.20 * ((dte == 1) & ~visada)
+
+        alinhado_now = (self.cx[self.jog] == self.cx[self.ini]) | (self.cy[self.jog] == self.cy[self.ini])
+        recompensa += 0.10 * (alinhado_prev & ~alinhado_now)
+        recompensa -= 0.08 * (~alinhado_prev & alinhado_now & exposto)
+
+        busca_kit = (self.vida <= 65) & self.tem_kit
+        busca_caixa = (self.municao <= 2) & self.tem_caixa
+        phi_prev = -0.6*dkv_prev*busca_kit - 0.5*dmn_prev*busca_caixa
+        phi_now = -0.6*self.dist[self.jog, self.kit_vida]*busca_kit - 0.5*self.dist[self.jog, self.caixa_municao]*busca_caixa
+        recompensa += 0.03 * (phi_now - phi_prev)
+
+        # hist_pos[-4] == hist_pos[-2] == posição atual, com pelo menos 4 posições
+        preso = (self.passos >= 3) & (self.hist[:, 2] == self.hist[:, 0]) & (self.hist[:, 0] == self.jog)
+        recompensa[preso] -= 0.18
+        self.hist[:, 1:] = self.hist[:, :-1].copy()
+        self.hist[:, 0] = self.jog
+        linhas = np.arange(B)
+        self.visitas[linhas, self.jog] += 1
+        recompensa += 0.02 * (self.visitas[linhas, self.jog] <= 2)
+
+        corner_now = self.canto[self.jog]
+        recompensa -= 0.6 * ((corner_now >= 1) & exposto)
+        recompensa += 0.09 * np.maximum(corner_prev - corner_now, 0)
+
+        fim |= self.passos >= self.max_passos
+        estado_final = self._estado()
+        # matou: mesmo critério dos treinos escalar e paralelo (s2[6] == 0, ou
+        # seja, vida do inimigo abaixo de 10 no fim da partida)
+        info = {"estado_final": estado_final, "matou": estado_final[:, 6] == 0}
+        if fim.any():
+            estados = self.reset(fim)
+        else:
+            estados = estado_final
+        return estados, recompensa, fim, info
+
 # -------------------------
 # Agente Q-learning tabular simples
 # -------------------------
 class AgenteQLearning:
-    def __init__(self, n_acoes, alfa=0.12, gama=0.98, epsilon=1.0, epsilon_min=0.04, decaimento=0.99994):
+    # Q denso: o estado (tupla de _estado()) vira um inteiro em base mista
+    # (dims = nº de valores de cada campo) e indexa uma linha float32 com as
+    # n_acoes ações. np.zeros não toca a memória, então só as páginas de
+    # estados visitados chegam a ocupar RAM; `visitados` marca as linhas já
+    # atualizadas para salvar sem varrer a tabela inteira.
+    def __init__(self, n_acoes, dims, alfa=0.12, gama=0.98, epsilon=1.0, epsilon_min=0.04, decaimento=0.99994, rng=None):
         self.n_acoes = n_acoes
+        self.rng = rng if rng is not None else random
+        self.dims = tuple(dims)
         self.alfa = alfa
         self.gama = gama
         self.epsilon = epsilon
         self.epsilon_min = epsilon_min
         self.decaimento = decaimento
-        self.Q: Dict[Tuple, float] = defaultdict(float)
-
+        pesos, p = [], 1
+        for d in reversed(self.dims):
+            pesos.append(p); p *= d
+        self.pesos = tuple(reversed(pesos))
+        self._pesos_np = np.array(self.pesos, dtype=np.int64)
+        self.Q = np.zeros((p, n_acoes), dtype=np.float32)
+        self.visitados = np.zeros(p, dtype=bool)
+
+    def indice(self, estado):
+        return sum(map(mul, estado, self.pesos))
+
+    def estado(self, indice):
+        return tuple(int(v) for v in np.unravel_index(indice, self.dims))
+
+    # linhas de 7 valores: tolist() + max() do Python sai mais barato que
+    # argmax()/max() do numpy, e index() mantém o desempate pela 1ª ação
     def escolher_acao(self, estado):
-        if random.random() < self.epsilon:
-            return random.randrange(self.n_acoes)
-        melhor_a, melhor_q = 0, float("-inf")
-        for a in range(self.n_acoes):
-            q = self.Q[(estado, a)]
-            if q > melhor_q:
-                melhor_q, melhor_a = q, a
-        return melhor_a
+        if self.rng.random() < self.epsilon:
+            return self.rng.randrange(self.n_acoes)
+        q = self.Q[self.indice(estado)].tolist()
+        return q.index(max(q))
 
     def atualizar(self, s, a, r, s2, fim):
-        qsa = self.Q[(s, a)]
+        i = self.indice(s)
+        self.visitados[i] = True
+        linha = self.Q[i]
+        qsa = linha.item(a)
         if fim:
             alvo = r
         else:
-            max_q = max(self.Q[(s2, a2)] for a2 in range(self.n_acoes))
-            alvo = r + self.gama * max_q
-        self.Q[(s, a)] = qsa + self.alfa * (alvo - qsa)
-
-    def decair_exploracao(self):
-        self.epsilon = max(self.epsilon_min, self.epsilon * self.decaimento)
+            alvo = r + self.gama * max(self.Q[self.indice(s2)].tolist())
+        linha[a] = qsa + self.alfa * (alvo - qsa)
+
+    def decair_exploracao(self, episodios=1):
+        self.epsilon = max(self.epsilon_min, self.epsilon * self.decaimento**episodios)
+
+    # versões em lote, para JogoAcaoEnvLote: estados é um array [n, 8]
+    def indices(self, estados):
+        return estados @ self._pesos_np
+
+    def escolher_acoes(self, estados, rng):
+        acoes = self.Q[self.indices(estados)].argmax(1)
+        explorar = rng.random(len(acoes)) < self.epsilon
+        acoes[explorar] = rng.integers(0, self.n_acoes, int(explorar.sum()))
+        return acoes
+
+    def atualizar_lote(self, s, a, r, s2, fim):
+        # pares (estado, ação) repetidos no lote recebem a média das suas
+        # correções, não a soma: somar daria um passo de k*alfa e divergiria
+        # quando as partidas reiniciam juntas
+        i = self.indices(s)
+        self.visitados[i] = True
+        alvo = r + self.gama * self.Q[self.indices(s2)].max(1) * ~fim
+        pares, inverso, contagem = np.unique(i * self.n_acoes + a, return_inverse=True, return_counts=True)
+        correcao = np.bincount(inverso, weights=self.alfa * (alvo - self.Q[i, a])) / contagem
+        self.Q.reshape(-1)[pares] += correcao
 
 # -------------------------
 # utilitários salvar/carregar
 # -------------------------
-def salvar_politica(agente, caminho="qtable_final.pkl"):
+# Formato binário (.bin): cabeçalho, dims do estado, metadados opcionais
+# (pickle; checkpoints guardam episódio, epsilon e estado do RNG), depois os
+# índices dos estados visitados (int64, crescentes) e as linhas de Q (float32).
+# Lido via mmap: a demo consulta direto do arquivo, sem carregar a tabela.
+# Arquivos .pkl continuam no formato antigo {(estado, ação): q}.
+_QTB_MAGICO = b"QTB1"
+_QTB_CAB = struct.Struct("<4sIIQQ")  # mágico, n_acoes, n_dims, n_linhas, tamanho dos metadados
+
+def _alinhar(n): return (n + 7) & ~7
+
+def gravar_tabela(agente, caminho, meta=None):
+    linhas = np.flatnonzero(agente.visitados)
+    meta_b = pickle.dumps(meta) if meta is not None else b""
+    tmp = caminho + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_QTB_CAB.pack(_QTB_MAGICO, agente.n_acoes, len(agente.dims), len(linhas), len(meta_b)))
+        f.write(np.array(agente.dims, "<u4").tobytes())
+        f.write(meta_b)
+        f.write(bytes(_alinhar(f.tell()) - f.tell()))
+        f.write(linhas.astype("<i8").tobytes())
+        f.write(agente.Q[linhas].astype("<f4").tobytes())
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, caminho)  # um checkpoint interrompido não estraga o anterior
+
+class PoliticaMmap:
+    """Tabela Q binária aberta via mmap; só as páginas consultadas são lidas."""
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magico, self.n_acoes, n_dims, n, tam_meta = _QTB_CAB.unpack_from(mm, 0)
+        if magico != _QTB_MAGICO:
+            raise ValueError(f"{caminho}: não é uma tabela Q binária")
+        pos = _QTB_CAB.size
+        self.dims = tuple(np.frombuffer(mm, "<u4", n_dims, pos).tolist()); pos += 4*n_dims
+        self.meta = pickle.loads(mm[pos:pos+tam_meta]) if tam_meta else None
+        pos = _alinhar(pos + tam_meta)
+        self.indices = np.frombuffer(mm, "<i8", n, pos); pos += 8*n
+        self.valores = np.frombuffer(mm, "<f4", n*self.n_acoes, pos).reshape(n, self.n_acoes)
+        self._zeros = np.zeros(self.n_acoes, np.float32)
+
+    def linha(self, i):
+        j = int(np.searchsorted(self.indices, i))
+        if j < len(self.indices) and self.indices[j] == i:
+            return self.valores[j]
+        return self._zeros
+
+def _abrir_politica(agente, caminho):
+    politica = PoliticaMmap(caminho)
+    if politica.dims != agente.dims or politica.n_acoes != agente.n_acoes:
+        raise ValueError(f"{caminho}: tabela para estados {politica.dims}, o ambiente usa {agente.dims}")
+    return politica
+
+def salvar_politica(agente, caminho="qtable_final.bin"):
+    if not caminho.endswith(".pkl"):
+        gravar_tabela(agente, caminho)
+        return
+    politica = {}
+    for i in np.flatnonzero(agente.visitados).tolist():
+        s = agente.estado(i)
+        for a, q in enumerate(agente.Q[i].tolist()):
+            if q: politica[(s, a)] = q
     with open(caminho, "wb") as f:
-        pickle.dump(dict(agente.Q), f)
+        pickle.dump(politica, f)
 
-def carregar_politica(agente, caminho="qtable_final.pkl"):
-    if os.path.exists(caminho):
-        with open(caminho, "rb") as f:
-            agente.Q.update(pickle.load(f))
+def carregar_politica(agente, caminho="qtable_final.bin"):
+    if not os.path.exists(caminho):
+        return False
+    if not caminho.endswith(".pkl"):
+        politica = _abrir_politica(agente, caminho)
+        agente.Q[politica.indices] = politica.valores
+        agente.visitados[politica.indices] = True
         return True
-    return False
+    with open(caminho, "rb") as f:
+        for (s, a), q in pickle.load(f).items():
+            i = agente.indice(s)
+            agente.Q[i, a] = q
+            agente.visitados[i] = True
+    return True
+
+# checkpoint: a tabela no formato binário, com o progresso do treino nos metadados
+# e o modo de treino ("escalar", "lote" ou "paralelo"), dono do formato do estado do RNG
+def salvar_checkpoint(agente, caminho, episodio, modo, rng_estado, fila, wins):
+    gravar_tabela(agente, caminho, {"episodio": episodio, "epsilon": agente.epsilon, "modo": modo,
+                                    "rng": rng_estado, "fila": list(fila), "wins": list(wins)})
+
+def carregar_checkpoint(agente, caminho, modo, fila, wins):
+    """Restaura Q, epsilon e as janelas do log; devolve os metadados (None se não há checkpoint).
+    Se o checkpoint veio de outro modo de treino, meta["rng"] volta None e o
+    treino segue com uma semente nova."""
+    if not os.path.exists(caminho):
+        return None
+    carregar_politica(agente, caminho)
+    meta = PoliticaMmap(caminho).meta
+    agente.epsilon = meta["epsilon"]
+    fila.extend(meta["fila"]); wins.extend(meta["wins"])
+    print(f"[checkpoint] retomando de {caminho} no episódio {meta['episodio']}")
+    # checkpoints sem "modo" (mais antigos): deduz pelo formato do estado do RNG
+    rng = meta["rng"]
+    gravado = meta.get("modo") or ("paralelo" if rng is None else "lote" if isinstance(rng, dict) else "escalar")
+    if gravado != modo:
+        print(f"[checkpoint] gravado no modo {gravado}; no modo {modo} o RNG recomeça com nova semente")
+        meta["rng"] = None
+    return meta
 
 # -------------------------
 # treino
 # -------------------------
 def treinar(episodios=30000, tamanho=10, semente=42,
             alfa=0.12, gama=0.98, epsilon=1.0, epsilon_min=0.04, decaimento=0.99994,
-            max_passos=360, janela_media=300, log_cada=300):
+            max_passos=360, janela_media=300, log_cada=300, lote=0, workers=1,
+            checkpoint=None, checkpoint_cada=1000, retomar=False):
+    if lote:
+        return treinar_lote(episodios, tamanho, semente, alfa, gama, epsilon, epsilon_min, decaimento,
+                            max_passos, janela_media, log_cada, n_jogos=lote,
+                            checkpoint=checkpoint, checkpoint_cada=checkpoint_cada, retomar=retomar)
+    if workers > 1:
+        return treinar_paralelo(episodios, tamanho, semente, alfa, gama, epsilon, epsilon_min, decaimento,
+                                max_passos, janela_media, log_cada, workers=workers,
+                                checkpoint=checkpoint, checkpoint_cada=checkpoint_cada, retomar=retomar)
     env = JogoAcaoEnv(tamanho=tamanho, max_passos=max_passos, semente=semente)
-    agente = AgenteQLearning(n_acoes=env.acoes, alfa=alfa, gama=gama,
+    agente = AgenteQLearning(n_acoes=env.acoes, dims=env.dims_estado, alfa=alfa, gama=gama,
                              epsilon=epsilon, epsilon_min=epsilon_min, decaimento=decaimento)
     fila = deque(maxlen=janela_media)
     wins = deque(maxlen=log_cada)
-    for ep in range(1, episodios+1):
+    ep0 = 0
+    meta = carregar_checkpoint(agente, checkpoint, "escalar", fila, wins) if retomar and checkpoint else None
+    if meta:
+        ep0 = meta["episodio"]
+        # o agente usa o mesmo RNG do ambiente
+        if meta["rng"] is not None: env.rng.setstate(meta["rng"])
+        else: env.rng.seed(semente + ep0)
+    for ep in range(ep0+1, episodios+1):
         s = env.reset(); total = 0.0; fim = False; matou = False
         while not fim:
             a = agente.escolher_acao(s)
@@ -404,13 +852,133 @@ def treinar(episodios=30000, tamanho=10, semente=42,
             media = sum(fila)/len(fila) if fila else 0.0
             wr = sum(wins)/len(wins) if wins else 0.0
             print(f"[ep {ep}] média {media:.3f} | win-rate {wr:.3f} | epsilon {agente.epsilon:.3f}")
-    salvar_politica(agente, "qtable_final.pkl")
+        if checkpoint and (ep == episodios or checkpoint_cada and ep % checkpoint_cada == 0):
+            salvar_checkpoint(agente, checkpoint, ep, "escalar", env.rng.getstate(), fila, wins)
+    salvar_politica(agente, "qtable_final.bin")
+    return env, agente
+
+def treinar_lote(episodios=30000, tamanho=10, semente=42,
+                 alfa=0.12, gama=0.98, epsilon=1.0, epsilon_min=0.04, decaimento=0.99994,
+                 max_passos=360, janela_media=300, log_cada=300, n_jogos=1024,
+                 checkpoint=None, checkpoint_cada=1000, retomar=False):
+    # mesmo treino, com n_jogos partidas de JogoAcaoEnvLote avançando juntas;
+    # os episódios são contados (e o epsilon decai) à medida que terminam.
+    # Ao retomar, as partidas em andamento no checkpoint recomeçam do zero.
+    env = JogoAcaoEnvLote(n_jogos=n_jogos, tamanho=tamanho, max_passos=max_passos, semente=semente)
+    agente = AgenteQLearning(n_acoes=env.acoes, dims=env.dims_estado, alfa=alfa, gama=gama,
+                             epsilon=epsilon, epsilon_min=epsilon_min, decaimento=decaimento)
+    fila = deque(maxlen=janela_media)
+    wins = deque(maxlen=log_cada)
+    ep = 0
+    meta = carregar_checkpoint(agente, checkpoint, "lote", fila, wins) if retomar and checkpoint else None
+    if meta:
+        ep = meta["episodio"]
+        if meta["rng"] is not None: env.rng.bit_generator.state = meta["rng"]
+        else: env.rng = np.random.default_rng(semente + ep)
+    totais = np.zeros(n_jogos)
+    s = env.reset()
+    while ep < episodios:
+        a = agente.escolher_acoes(s, env.rng)
+        s2, r, fim, info = env.step(a)
+        agente.atualizar_lote(s, a, r, info["estado_final"], fim)
+        totais += r
+        for total, matou in zip(totais[fim].tolist(), info["matou"][fim].tolist()):
+            ep += 1
+            fila.append(total); wins.append(1 if matou else 0)
+            if ep % log_cada == 0:
+                media = sum(fila)/len(fila) if fila else 0.0
+                wr = sum(wins)/len(wins) if wins else 0.0
+                print(f"[ep {ep}] média {media:.3f} | win-rate {wr:.3f} | epsilon {agente.epsilon:.3f}")
+            agente.decair_exploracao()
+            if checkpoint and (ep == episodios or checkpoint_cada and ep % checkpoint_cada == 0):
+                salvar_checkpoint(agente, checkpoint, ep, "lote", env.rng.bit_generator.state, fila, wins)
+            if ep == episodios: break
+        totais[fim] = 0.0
+        s = s2
+    salvar_politica(agente, "qtable_final.bin")
+    return env, agente
+
+def compartilhar_tabela(agente):
+    # move Q e visitados para um mmap anônimo compartilhado: processos criados
+    # por fork depois disso escrevem na mesma tabela (atualizações sem lock,
+    # no estilo Hogwild). Como no np.zeros, só as páginas tocadas ocupam RAM.
+    n = agente.Q.shape[0]
+    buf = mmap.mmap(-1, agente.Q.nbytes + n)
+    agente.Q = np.frombuffer(buf, np.float32, n * agente.n_acoes).reshape(n, agente.n_acoes)
+    agente.visitados = np.frombuffer(buf, bool, n, offset=agente.Q.nbytes)
+
+def _trabalhador(agente, k, episodios, tamanho, semente, max_passos, epsilon, contador, saida):
+    # cada worker tem seu random.Random e seu ambiente; o epsilon segue o nº
+    # global de episódios, como no treino com um processo só
+    rng = random.Random(semente + k)
+    env = JogoAcaoEnv(tamanho=tamanho, max_passos=max_passos, rng=rng)
+    agente.rng = rng
+    agente.epsilon = max(agente.epsilon_min, epsilon * agente.decaimento**contador.value)
+    for _ in range(episodios):
+        s = env.reset(); total = 0.0; fim = False; matou = False
+        while not fim:
+            a = agente.escolher_acao(s)
+            s2, r, fim, _ = env.step(a)
+            if s2[6] == 0: matou = True
+            agente.atualizar(s, a, r, s2, fim)
+            s = s2; total += r
+        with contador.get_lock():
+            contador.value += 1
+            feitos = contador.value
+        agente.epsilon = max(agente.epsilon_min, epsilon * agente.decaimento**feitos)
+        saida.put((total, matou))
+
+def treinar_paralelo(episodios=30000, tamanho=10, semente=42,
+                     alfa=0.12, gama=0.98, epsilon=1.0, epsilon_min=0.04, decaimento=0.99994,
+                     max_passos=360, janela_media=300, log_cada=300, workers=2,
+                     checkpoint=None, checkpoint_cada=1000, retomar=False):
+    # usa fork para herdar a tabela compartilhada (Linux/macOS)
+    ctx = multiprocessing.get_context("fork")
+    env = JogoAcaoEnv(tamanho=tamanho, max_passos=max_passos, rng=random.Random(semente))
+    agente = AgenteQLearning(n_acoes=env.acoes, dims=env.dims_estado, alfa=alfa, gama=gama,
+                             epsilon=epsilon, epsilon_min=epsilon_min, decaimento=decaimento)
+    compartilhar_tabela(agente)
+    fila = deque(maxlen=janela_media)
+    wins = deque(maxlen=log_cada)
+    ep = 0
+    meta = carregar_checkpoint(agente, checkpoint, "paralelo", fila, wins) if retomar and checkpoint else None
+    if meta:
+        # os RNGs dos workers não vão no checkpoint: ao retomar, as sementes
+        # andam com o episódio para não repetir as mesmas partidas
+        ep = meta["episodio"]
+    contador, saida = ctx.Value("q", ep), ctx.Queue()
+    restantes = max(0, episodios - ep)
+    procs = [ctx.Process(target=_trabalhador, daemon=True,
+                         args=(agente, k, restantes//workers + (k < restantes % workers), tamanho,
+                               semente + ep, max_passos, epsilon, contador, saida))
+             for k in range(workers)]
+    for p in procs: p.start()
+    while ep < episodios:
+        try:
+            total, matou = saida.get(timeout=1.0)
+        except queue.Empty:
+            if any(p.exitcode not in (None, 0) for p in procs):
+                raise RuntimeError("um worker do treino terminou com erro")
+            continue
+        ep += 1
+        fila.append(total); wins.append(1 if matou else 0)
+        eps = max(epsilon_min, epsilon * decaimento**ep)
+        if ep % log_cada == 0:
+            media = sum(fila)/len(fila) if fila else 0.0
+            wr = sum(wins)/len(wins) if wins else 0.0
+            print(f"[ep {ep}] média {media:.3f} | win-rate {wr:.3f} | epsilon {eps:.3f}")
+        if checkpoint and (ep == episodios or checkpoint_cada and ep % checkpoint_cada == 0):
+            agente.epsilon = eps
+            salvar_checkpoint(agente, checkpoint, ep, "paralelo", None, fila, wins)
+    for p in procs: p.join()
+    agente.epsilon = max(epsilon_min, epsilon * decaimento**episodios)
+    salvar_politica(agente, "qtable_final.bin")
     return env, agente
 
 # -------------------------
 # Demo pygame com projéteis e toast
 # -------------------------
-def rodar_demo_pygame(tamanho=10, max_passos=360, framerate=12, seed=7, qtable_path="qtable_final.pkl", epsilon_demo=0.05):
+def rodar_demo_pygame(tamanho=10, max_passos=360, framerate=12, seed=7, qtable_path="qtable_final.bin", epsilon_demo=0.05):
     try:
         import pygame
     except Exception:
@@ -472,18 +1040,17 @@ def rodar_demo_pygame(tamanho=10, max_passos=360, framerate=12, seed=7, qtable_p
     clock = pygame.time.Clock()
 
     env = JogoAcaoEnv(tamanho=tamanho, max_passos=max_passos, semente=seed)
-    ag = AgenteQLearning(n_acoes=env.acoes)
-    if os.path.exists(qtable_path):
-        with open(qtable_path,"rb") as f:
-            ag.Q.update(pickle.load(f))
+    ag = AgenteQLearning(n_acoes=env.acoes, dims=env.dims_estado)
+    if os.path.exists(qtable_path) and not qtable_path.endswith(".pkl"):
+        linha_q = _abrir_politica(ag, qtable_path).linha  # consulta direto do arquivo
+    else:
+        carregar_politica(ag, qtable_path)
+        linha_q = ag.Q.__getitem__
 
     def argmax_eps(ag, s, n, eps):
         if random.random() < eps: return random.randrange(n)
-        best_a, best_q = 0, float("-inf")
-        for a in range(n):
-            q = ag.Q[(s,a)]
-            if q > best_q: best_q, best_a = q, a
-        return best_a
+        q = linha_q(ag.indice(s)).tolist()
+        return q.index(max(q))
 
     s = env.reset()
     vida_prev, vida_npc_prev = env.vida, env.vida_inimigo
@@ -547,8 +1114,20 @@ def main():
     ap.add_argument("--episodios", type=int, default=30000)
     ap.add_argument("--tamanho", type=int, default=10)
     ap.add_argument("--seed", type=int, default=42)
-    ap.add_argument("--qtable", type=str, default="qtable_final.pkl")
+    ap.add_argument("--qtable", type=str, default="qtable_final.bin",
+                    help="política (.bin binário via mmap; .pkl no formato antigo)")
+    ap.add_argument("--checkpoint", type=str, default="checkpoint_treino.bin")
+    ap.add_argument("--checkpoint-cada", type=int, default=1000, help="episódios entre checkpoints (0 = só no fim)")
+    ap.add_argument("--resume", action="store_true", help="retoma o treino do --checkpoint")
+    ap.add_argument("--lote", type=int, default=0,
+                    help="partidas simultâneas no ambiente em lote (JogoAcaoEnvLote); 0 = uma por vez")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="processos de treino compartilhando a tabela Q (0 = todos os núcleos)")
     args = ap.parse_args()
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    if args.lote and args.workers > 1:
+        ap.error("use --lote ou --workers, não os dois")
 
     global max_passos, epsilon_demo, qtable_path
     max_passos = 360
@@ -556,7 +1135,9 @@ def main():
     qtable_path = args.qtable
 
     if args.treinar:
-        env, ag = treinar(episodios=args.episodios, tamanho=args.tamanho, semente=args.seed)
+        env, ag = treinar(episodios=args.episodios, tamanho=args.tamanho, semente=args.seed,
+                          lote=args.lote, workers=args.workers, checkpoint=args.checkpoint,
+                          checkpoint_cada=args.checkpoint_cada, retomar=args.resume)
         salvar_politica(ag, args.qtable)
     if args.demo:
         rodar_demo_pygame(tamanho=args.tamanho, max_passos=max_passos, seed=args.seed, qtable_path=args.qtable)
@@ -0,0 +1,171 @@
+"""Benchmark dos caminhos quentes do agente10.
+
+Mede, com sementes fixas, passos/s de JogoAcaoEnv.step, escolhas/s e
+atualizações/s de AgenteQLearning, episódios/s do treino completo (`treinar`)
+e, opcionalmente, passos/s de JogoAcaoEnvLote, além da memória da tabela Q.
+Para conferir que uma otimização não mudou o aprendizado, cada linha traz o
+sha256 do log de treino (curva_sha) e da tabela Q final (q_sha): com a mesma
+semente, os dois têm de ser iguais entre commits.
+
+Listas separadas por vírgula em --tamanho/--episodios varrem todas as
+combinações; cada execução imprime uma linha JSON:
+
+    python benchmark.py --tamanho 6,10,14 --episodios 500,2000 > antes.jsonl
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from agente10 import AgenteQLearning, JogoAcaoEnv, JogoAcaoEnvLote, treinar
+
+def _melhor(medir, repeticoes: int) -> float:
+    """Maior taxa (operações/s) entre `repeticoes` execuções de medir()."""
+    taxa = 0.0
+    for _ in range(repeticoes):
+        n, t0 = medir()
+        taxa = max(taxa, n / (time.perf_counter() - t0))
+    return taxa
+
+def medir_step(tamanho: int, passos: int, seed: int, repeticoes: int) -> float:
+    acoes = [random.Random(seed + 1).randrange(7) for _ in range(passos)]
+    def medir():
+        env = JogoAcaoEnv(tamanho=tamanho, rng=random.Random(seed))
+        env.reset()
+        t0 = time.perf_counter()
+        for a in acoes:
+            if env.step(a)[2]: env.reset()
+        return passos, t0
+    return _melhor(medir, repeticoes)
+
+def _transicoes(tamanho: int, passos: int, seed: int):
+    env = JogoAcaoEnv(tamanho=tamanho, rng=random.Random(seed))
+    rng = random.Random(seed + 1)
+    s = env.reset()
+    saida = []
+    for _ in range(passos):
+        a = rng.randrange(env.acoes)
+        s2, r, fim, _ = env.step(a)
+        saida.append((s, a, r, s2, fim))
+        s = env.reset() if fim else s2
+    return env, saida
+
+def medir_agente(tamanho: int, passos: int, seed: int, repeticoes: int):
+    """(escolhas/s, atualizações/s) sobre as mesmas transições gravadas."""
+    env, trans = _transicoes(tamanho, passos, seed)
+    ag = AgenteQLearning(n_acoes=env.acoes, dims=env.dims_estado, epsilon=0.0)
+    def atualizar():
+        t0 = time.perf_counter()
+        for s, a, r, s2, fim in trans: ag.atualizar(s, a, r, s2, fim)
+        return passos, t0
+    def escolher():
+        t0 = time.perf_counter()
+        for s, _, _, _, _ in trans: ag.escolher_acao(s)
+        return passos, t0
+    atualizacoes = _melhor(atualizar, repeticoes)
+    return _melhor(escolher, repeticoes), atualizacoes
+
+def medir_lote(tamanho: int, n_jogos: int, passos: int, seed: int, repeticoes: int) -> float:
+    iteracoes = max(1, passos // n_jogos)
+    acoes = np.random.default_rng(seed + 1).integers(0, 7, (iteracoes, n_jogos))
+    def medir():
+        env = JogoAcaoEnvLote(n_jogos=n_jogos, tamanho=tamanho, semente=seed)
+        t0 = time.perf_counter()
+        for a in acoes: env.step(a)
+        return iteracoes * n_jogos, t0
+    return _melhor(medir, repeticoes)
+
+def verificar_lote_repetido(tamanho: int, n_jogos: int, seed: int) -> bool:
+    """Lote com a mesma transição terminal (r=1) em todas as partidas, como
+    logo após um reset conjunto: Q tem de convergir para 1, não divergir."""
+    env = JogoAcaoEnvLote(n_jogos=n_jogos, tamanho=tamanho, semente=seed)
+    ag = AgenteQLearning(n_acoes=env.acoes, dims=env.dims_estado)
+    s = env.reset()
+    a = np.zeros(n_jogos, np.int64)
+    for _ in range(100):
+        ag.atualizar_lote(s, a, np.ones(n_jogos), s, np.ones(n_jogos, bool))
+    q = float(ag.Q[ag.indices(s[:1])[0], 0])
+    if not 0.0 < q <= 1.0 + 1e-6:
+        raise AssertionError(f"atualizar_lote divergiu num lote repetido: Q = {q}")
+    return True
+
+def medir_treino(tamanho: int, episodios: int, seed: int, log_cada: int) -> dict:
+    """Um treino completo com `treinar`, num diretório temporário para não
+    sobrescrever a política nem o checkpoint do usuário."""
+    log = io.StringIO()
+    origem = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(log):
+                t0 = time.perf_counter()
+                env, ag = treinar(episodios=episodios, tamanho=tamanho, semente=seed, log_cada=log_cada)
+                dt = time.perf_counter() - t0
+        finally:
+            os.chdir(origem)
+    linhas = np.flatnonzero(ag.visitados)
+    q_sha = hashlib.sha256(linhas.astype("<i8").tobytes() + ag.Q[linhas].astype("<f4").tobytes())
+    ultima = log.getvalue().strip().splitlines()[-1] if log.getvalue().strip() else ""
+    campos = ultima.replace("|", "").split()
+    return {
+        "episodios_s": round(episodios / dt, 1),
+        "curva_sha": hashlib.sha256(log.getvalue().encode()).hexdigest()[:16],
+        "q_sha": q_sha.hexdigest()[:16],
+        "media_final": float(campos[3]) if len(campos) > 3 else None,
+        "win_rate_final": float(campos[5]) if len(campos) > 5 else None,
+        "q_estados": int(len(linhas)),
+        "q_bytes": int(len(linhas) * ag.n_acoes * ag.Q.itemsize),
+        "q_bytes_reservados": int(ag.Q.nbytes),
+    }
+
+def _commit():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _lista(tipo):
+    return lambda texto: [tipo(x) for x in texto.split(",") if x.strip()]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark do ambiente e do agente Q-learning.")
+    ap.add_argument("--tamanho", type=_lista(int), default=[10], help="tamanhos de grade (lista separada por vírgula)")
+    ap.add_argument("--episodios", type=_lista(int), default=[1000], help="episódios de treino")
+    ap.add_argument("--passos", type=int, default=20000, help="passos nas medições de step/agente/lote")
+    ap.add_argument("--repeticoes", type=int, default=3, help="vale a melhor de N execuções")
+    ap.add_argument("--lote", type=int, default=256, help="partidas de JogoAcaoEnvLote (0 = não mede)")
+    ap.add_argument("--log-cada", type=int, default=100, help="janela do log usado em curva_sha")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    base = {"commit": _commit(), "python": platform.python_version(), "numpy": np.__version__, "seed": args.seed}
+    micro = {}
+    for tamanho, episodios in itertools.product(args.tamanho, args.episodios):
+        if tamanho not in micro:
+            escolhas, atualizacoes = medir_agente(tamanho, args.passos, args.seed, args.repeticoes)
+            micro[tamanho] = {
+                "step_s": round(medir_step(tamanho, args.passos, args.seed, args.repeticoes), 1),
+                "escolhas_s": round(escolhas, 1),
+                "atualizacoes_s": round(atualizacoes, 1),
+                "lote": args.lote or None,
+                "lote_passos_s": round(medir_lote(tamanho, args.lote, args.passos, args.seed, args.repeticoes), 1)
+                                 if args.lote else None,
+                "lote_q_limitado": verificar_lote_repetido(tamanho, args.lote, args.seed) if args.lote else None,
+            }
+        linha = dict(base, tamanho=tamanho, episodios=episodios, **micro[tamanho])
+        linha.update(medir_treino(tamanho, episodios, args.seed, args.log_cada))
+        print(json.dumps(linha), flush=True)
+
+if __name__ == "__main__":
+    main()